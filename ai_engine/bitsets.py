@@ -0,0 +1,84 @@
+# ai_engine/bitsets.py
+"""
+Per-habit completion bitsets shared by the rules engine and stats.
+
+A user's completions over a date range become one Python int per habit:
+bit i is set when the habit was done on start + i days. Window queries
+("done in the last 14 days?", "missed all of the last 3?") are then a
+shift, a mask and int.bit_count() instead of formatting date strings and
+probing sets day by day.
+"""
+from datetime import date
+
+
+class HabitBits:
+
+    def __init__(self, start, bits):
+        """
+        start: date of bit 0 (None when there are no completions)
+        bits: dict habit_id -> int
+        """
+        self.start = start
+        self.bits = bits
+
+    @classmethod
+    def from_pairs(cls, pairs, start=None, end=None):
+        """
+        pairs: iterable of (habit_id, 'YYYY-MM-DD'), e.g. completions rows
+        start/end: optional dates; completions outside them are dropped.
+        start defaults to the earliest completion.
+        """
+        by_date = {}
+        for hid, d in pairs:
+            by_date.setdefault(d, []).append(hid)
+        return cls._build(by_date, start, end)
+
+    @classmethod
+    def from_map(cls, completions_map, start=None, end=None):
+        """completions_map: dict date->set(habit_id)"""
+        return cls._build(completions_map, start, end)
+
+    @classmethod
+    def _build(cls, by_date, start, end):
+        days = {date.fromisoformat(d): hids for d, hids in by_date.items() if hids}
+        if start is None:
+            start = min(days) if days else None
+        bits = {}
+        for day, hids in days.items():
+            off = (day - start).days
+            if off < 0 or (end is not None and day > end):
+                continue
+            bit = 1 << off
+            for hid in hids:
+                bits[hid] = bits.get(hid, 0) | bit
+        return cls(start, bits)
+
+    def window(self, habit_id, first, last):
+        """Bits of first..last (dates, inclusive) for one habit; bit 0 = first."""
+        return self._window(self.bits.get(habit_id, 0), first, last)
+
+    def count(self, habit_id, first=None, last=None):
+        """Number of days done, over the whole range or first..last."""
+        b = self.bits.get(habit_id, 0)
+        if first is not None:
+            b = self._window(b, first, last)
+        return b.bit_count()
+
+    def any_done(self):
+        """Bits of the days on which at least one habit was done."""
+        out = 0
+        for b in self.bits.values():
+            out |= b
+        return out
+
+    def total(self):
+        """Completions across all habits."""
+        return sum(b.bit_count() for b in self.bits.values())
+
+    def _window(self, b, first, last):
+        n = (last - first).days + 1
+        if n <= 0 or self.start is None:
+            return 0
+        off = (first - self.start).days
+        b = b >> off if off >= 0 else b << -off
+        return b & ((1 << n) - 1)
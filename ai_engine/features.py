@@ -0,0 +1,104 @@
+# ai_engine/features.py
+"""
+Array helpers shared by the trainer and the prediction path.
+
+Everything works on a dense date x habit boolean matrix (rows = dates in
+ascending order, columns = habits) so per-cell features become a handful of
+NumPy operations instead of Python loops over days.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+# Column order of the model input: recent7, streak, then one-hot day of week
+FEATURE_COLUMNS = ['recent7', 'streak'] + [f'dow_{i}' for i in range(7)]
+
+# Fixed factors applied to the model input before fitting, so SGD steps stay
+# well conditioned (streak is unbounded). Exported coefficients are scaled
+# back, so serving works on the raw features.
+FEATURE_SCALE = {'streak': 1 / 30}
+
+
+def completion_matrix(dates, habit_ids, completions_map):
+    """
+    dates: list of date strings (rows), habit_ids: list of habit ids (columns)
+    completions_map: dict date->set(habit_id)
+    Completions for habits not in habit_ids are ignored.
+    """
+    col = {hid: j for j, hid in enumerate(habit_ids)}
+    m = np.zeros((len(dates), len(habit_ids)), dtype=bool)
+    for i, d in enumerate(dates):
+        for hid in completions_map.get(d, ()):
+            j = col.get(hid)
+            if j is not None:
+                m[i, j] = True
+    return m
+
+
+def weekdays(dates):
+    """Monday=0 .. Sunday=6 for a list of YYYY-MM-DD strings."""
+    if not len(dates):
+        return np.zeros(0, dtype=np.int64)
+    days = np.array(dates, dtype='datetime64[D]').astype(np.int64)
+    # 1970-01-01 was a Thursday (weekday 3)
+    return (days + 3) % 7
+
+
+def trailing_rate(matrix, window=7, prefix=None, offset=0):
+    """
+    Per cell, the fraction of the last `window` rows (current row included)
+    that are set. Rows near the start divide by the number of rows seen so
+    far rather than by `window`.
+
+    prefix: the min(window - 1, offset) rows that precede `matrix`, used when
+            extending a previously built table
+    offset: total number of rows that precede `matrix`
+    """
+    n, k = matrix.shape
+    if prefix is None:
+        prefix = np.zeros((0, k), dtype=bool)
+    ext = np.vstack([prefix, matrix]).astype(np.int64)
+    csum = np.zeros((ext.shape[0] + 1, k), dtype=np.int64)
+    np.cumsum(ext, axis=0, out=csum[1:])
+    ends = np.arange(prefix.shape[0], prefix.shape[0] + n) + 1
+    starts = np.maximum(ends - window, 0)
+    sums = csum[ends] - csum[starts]
+    seen = np.minimum(np.arange(offset, offset + n) + 1, window)
+    return sums / seen[:, None]
+
+
+def run_lengths(matrix, initial=None):
+    """
+    Per cell, the number of consecutive set rows ending at that row (0 if the
+    cell itself is not set).
+    initial: per-column run length carried in from rows before `matrix`
+    """
+    n, k = matrix.shape
+    idx = np.arange(1, n + 1, dtype=np.int64)[:, None]
+    last_gap = np.maximum.accumulate(np.where(matrix, 0, idx), axis=0) if n else np.zeros((0, k), dtype=np.int64)
+    runs = idx - last_gap
+    if initial is not None:
+        runs = runs + np.where(last_gap == 0, np.asarray(initial, dtype=np.int64)[None, :], 0)
+    return runs
+
+
+def calendar_dates(end, days):
+    """`days` consecutive YYYY-MM-DD strings ending at date `end`, ascending."""
+    return [(end - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days - 1, -1, -1)]
+
+
+def next_day_features(habit_ids, completions_map, end, window=30):
+    """
+    Model input (rows = habits, columns = FEATURE_COLUMNS) for predicting
+    completion on the day after `end`:
+      recent7: completed days among the 7 calendar days ending at `end`, / 7
+      streak: consecutive completed days ending at `end`, looking back at
+              most `window` days
+      dow_*: one-hot weekday of end + 1
+    """
+    m = completion_matrix(calendar_dates(end, window + 1), habit_ids, completions_map)
+    x = np.zeros((len(habit_ids), len(FEATURE_COLUMNS)))
+    x[:, 0] = m[-7:].sum(axis=0) / 7.0
+    x[:, 1] = run_lengths(m)[-1] if len(m) else 0
+    x[:, 2 + (end + timedelta(days=1)).weekday()] = 1.0
+    return x
@@ -1,32 +1,236 @@
 # ai_engine/ml_model.py
-import os, joblib
+"""
+Per-user logistic models.
+
+Training (sklearn) pickles the fitted estimator, a logistic-loss
+SGDClassifier that incremental retrains update with partial_fit, and
+exports its coefficients to a small JSON file. Serving only
+reads the JSON and scores with a NumPy dot product + sigmoid, so the web
+worker never has to import sklearn or unpickle an estimator. sklearn and
+joblib are imported inside the training functions only.
+"""
+import os, json, threading
+from collections import OrderedDict
 import numpy as np
-import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
+from ai_engine.features import FEATURE_COLUMNS, FEATURE_SCALE
 
 MODEL_DIR = 'models'
-os.makedirs(MODEL_DIR, exist_ok=True)
+
+# Max number of user models kept in memory by the prediction path
+MODEL_CACHE_SIZE = int(os.environ.get('HABIT_MODEL_CACHE_SIZE', '256'))
+
+
+class ModelCache:
+    """
+    Thread-safe LRU cache of loaded models keyed by user id.
+    Each entry remembers the (mtime, size) of the file it was loaded from, so a
+    retrain that writes a new artifact is picked up on the next lookup.
+    loader: callable(path) -> model
+    """
+
+    def __init__(self, loader, maxsize=MODEL_CACHE_SIZE):
+        self.loader = loader
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (version, model)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def get(self, user_id, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(user_id)
+            return None
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.reloads += 1
+        # load outside the lock so one slow read does not block other users
+        model = self.loader(path)
+        with self._lock:
+            self._entries[user_id] = (version, model)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return model
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+            }
+
+
+class LinearModel:
+    """Coefficients of a fitted binary LogisticRegression, scored with NumPy."""
+
+    def __init__(self, columns, coef, intercept):
+        self.columns = list(columns)
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        # positions of the model's columns in FEATURE_COLUMNS
+        self._idx = [FEATURE_COLUMNS.index(c) for c in self.columns]
+
+    @classmethod
+    def from_estimator(cls, model, columns=None):
+        names = getattr(model, 'feature_names_in_', None)
+        if columns is None:
+            columns = list(names) if names is not None else FEATURE_COLUMNS
+        coef = model.coef_[0]
+        # fitted on scaled input (see scale_features); older pickles were not
+        scale = getattr(model, 'feature_scale_', None)
+        if scale is not None:
+            coef = coef * np.asarray(scale)
+        return cls(columns, coef, model.intercept_[0])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            d = json.load(f)
+        return cls(d['columns'], d['coef'], d['intercept'])
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'columns': self.columns, 'coef': self.coef.tolist(), 'intercept': self.intercept}, f)
+        os.replace(tmp, path)
+
+    def predict_proba(self, X):
+        """
+        Probability of the positive class for each row.
+        X: 2D array with FEATURE_COLUMNS, or a DataFrame with the model's columns
+        """
+        if hasattr(X, 'columns'):
+            X = X[self.columns].to_numpy(dtype=np.float64)
+        else:
+            X = np.asarray(X, dtype=np.float64)[:, self._idx]
+        z = X @ self.coef + self.intercept
+        # same as 1 / (1 + exp(-z)) without overflow warnings for large |z|
+        return np.exp(-np.logaddexp(0.0, -z))
+
+
+_model_cache = ModelCache(LinearModel.load)
+
+
+def model_cache_stats():
+    return _model_cache.stats()
+
+
+def ensure_model_dir():
+    # created on first write rather than at import, so importing this module
+    # (e.g. in the web worker) has no side effects
+    os.makedirs(MODEL_DIR, exist_ok=True)
 
 def model_path_for(user_id):
     return os.path.join(MODEL_DIR, f'user_{user_id}_model.pkl')
 
+def coef_path_for(user_id):
+    return os.path.join(MODEL_DIR, f'user_{user_id}_coef.json')
+
+def feature_state_path_for(user_id):
+    return os.path.join(MODEL_DIR, f'user_{user_id}_features.pkl')
+
+def scale_features(feature_df):
+    """The model input as the estimator sees it (see FEATURE_SCALE)."""
+    return feature_df * [FEATURE_SCALE.get(c, 1.0) for c in feature_df.columns]
+
+def new_estimator():
+    from sklearn.linear_model import SGDClassifier
+    # logistic loss (so predict_proba and coef_ match a logistic regression)
+    # that partial_fit can update; averaging keeps the small batches of an
+    # incremental retrain from jerking the weights around
+    return SGDClassifier(loss='log_loss', alpha=1e-4, average=True, random_state=0)
+
+def _save_model(user_id, model, columns):
+    import joblib
+    ensure_model_dir()
+    path = model_path_for(user_id)
+    # write to a temp file and rename so readers never see a half-written pickle
+    tmp = path + '.tmp'
+    joblib.dump(model, tmp)
+    os.replace(tmp, path)
+    LinearModel.from_estimator(model, columns).save(coef_path_for(user_id))
+    _model_cache.invalidate(user_id)
+    return path
+
 def train_model_for_user(user_id, feature_df, target_series):
-    """ feature_df: pandas.DataFrame, target_series: 0/1 series """
+    """
+    Fit a new model from scratch.
+    feature_df: pandas.DataFrame, target_series: 0/1 series
+    """
     if feature_df.empty:
         return None
+    from sklearn.model_selection import train_test_split
     X_train, X_test, y_train, y_test = train_test_split(feature_df, target_series, test_size=0.2, random_state=42)
-    model = LogisticRegression(max_iter=200)
-    model.fit(X_train, y_train)
+    model = new_estimator()
+    model.fit(scale_features(X_train), y_train)
+    model.feature_scale_ = [FEATURE_SCALE.get(c, 1.0) for c in feature_df.columns]
+    return _save_model(user_id, model, feature_df.columns)
+
+def update_model_for_user(user_id, feature_df, target_series):
+    """
+    Update the saved model with new rows (partial_fit). Returns the path, or
+    None if there is no saved model that can be updated with these columns
+    (e.g. a LogisticRegression pickled by an older version).
+    """
     path = model_path_for(user_id)
-    joblib.dump(model, path)
-    return path
+    if feature_df.empty or not os.path.exists(path):
+        return None
+    import joblib
+    try:
+        model = joblib.load(path)
+    except Exception:
+        return None
+    names = getattr(model, 'feature_names_in_', None)
+    if (not hasattr(model, 'partial_fit') or getattr(model, 'feature_scale_', None) is None
+            or names is None or list(names) != list(feature_df.columns)):
+        return None
+    model.partial_fit(scale_features(feature_df), target_series)
+    return _save_model(user_id, model, feature_df.columns)
 
-def predict_for_user(user_id, X):
-    """X: DataFrame or 2D array"""
+def export_coefficients(user_id):
+    """
+    Write the coefficient file for a model pickled before coefficients were
+    exported. Returns the path, or None if the user has no model.
+    """
     path = model_path_for(user_id)
     if not os.path.exists(path):
         return None
-    model = joblib.load(path)
-    probs = model.predict_proba(X)[:,1]
-    return probs
+    import joblib
+    out = coef_path_for(user_id)
+    LinearModel.from_estimator(joblib.load(path)).save(out)
+    return out
+
+def predict_for_user(user_id, X):
+    """X: DataFrame or 2D array with FEATURE_COLUMNS"""
+    path = coef_path_for(user_id)
+    model = _model_cache.get(user_id, path)
+    if model is None:
+        # legacy model without a coefficient file: convert it once
+        if export_coefficients(user_id) is None:
+            return None
+        model = _model_cache.get(user_id, path)
+    return model.predict_proba(X)
@@ -0,0 +1,182 @@
+# ai_engine/notifier.py
+"""
+Offline rule evaluation for every user (run daily, e.g. from cron).
+
+The write path only re-runs rules for users who change completions (through
+evaluate_users below, so both see the same window and produce the same
+messages), so time-based nudges ("you missed X for 3 days") need this job.
+Users are processed in id order, `chunk_size` at a time; each chunk is
+- one query for the current month's snapshot habits,
+- one query for the last LOOKBACK_DAYS of completions,
+- rules.evaluate over per-habit bitsets for each user,
+- one INSERT OR IGNORE executemany for the notes,
+committed together with the job's checkpoint, so an interrupted run
+resumes after the last finished chunk. A run limited with --rule keeps its
+own checkpoint, so it does not mark the full run for that date as done.
+
+CLI:
+  python -m ai_engine.notifier                 evaluate all users (resumes an unfinished run)
+  python -m ai_engine.notifier --restart       ignore the checkpoint
+  python -m ai_engine.notifier --rule missed_habit --date 2025-11-29
+"""
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from ai_engine import rules
+from ai_engine.bitsets import HabitBits
+from database import get_pool
+
+JOB = 'notifier'
+# the missed-habit rule looks back 14 days
+LOOKBACK_DAYS = 14
+
+
+def job_name(rule_names=None):
+    """Checkpoint key of a run: 'notifier', or 'notifier:rule_a,rule_b' for a limited run."""
+    return JOB if not rule_names else JOB + ':' + ','.join(sorted(set(rule_names)))
+
+
+def window(today):
+    """(first, last) day of completions the rules look at when run on `today`."""
+    return today - timedelta(days=LOOKBACK_DAYS), today
+
+
+def load_checkpoint(conn, run_date, job=JOB):
+    """User id to resume after for run_date (0 = start), or None if that run finished."""
+    row = conn.execute('SELECT run_date, last_user_id, finished FROM job_checkpoints WHERE job = ?', (job,)).fetchone()
+    if row is None or row[0] != run_date:
+        return 0
+    return None if row[2] else row[1]
+
+
+def save_checkpoint(conn, run_date, last_user_id, finished=False, job=JOB):
+    """Record progress. Does not commit: call inside the chunk's transaction."""
+    conn.execute("""
+        INSERT INTO job_checkpoints (job, run_date, last_user_id, finished, updated_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(job) DO UPDATE SET run_date = excluded.run_date, last_user_id = excluded.last_user_id,
+            finished = excluded.finished, updated_at = excluded.updated_at
+    """, (job, run_date, last_user_id, int(finished), datetime.utcnow().isoformat()))
+
+
+def iter_user_chunks(conn, after_id, chunk_size):
+    """Lists of user ids greater than after_id, in id order."""
+    while True:
+        ids = [r[0] for r in conn.execute('SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?', (after_id, chunk_size))]
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def load_chunk(conn, user_ids, today):
+    """
+    {user_id: (habits, HabitBits)} for a chunk: the current month's snapshot
+    habits and the completions of the LOOKBACK_DAYS days before today.
+    """
+    marks = ','.join('?' * len(user_ids))
+    habits = {uid: [] for uid in user_ids}
+    for uid, hid, name in conn.execute(
+            f'SELECT user_id, habit_id, name_at_that_time FROM habit_snapshots WHERE user_id IN ({marks}) AND month = ? ORDER BY user_id, habit_id',
+            user_ids + [today.strftime('%Y-%m')]):
+        habits[uid].append({'id': hid, 'name': name})
+    start, today = window(today)
+    pairs = {uid: [] for uid in user_ids}
+    for uid, hid, d in conn.execute(
+            f'SELECT user_id, habit_id, date FROM completions WHERE user_id IN ({marks}) AND date BETWEEN ? AND ?',
+            user_ids + [start.isoformat(), today.isoformat()]):
+        pairs[uid].append((hid, d))
+    return {uid: (habits[uid], HabitBits.from_pairs(pairs[uid], start, today)) for uid in user_ids}
+
+
+def evaluate_chunk(chunk, today, rule_fns):
+    """[(user_id, notes)] for users with at least one note."""
+    out = []
+    for uid, (habits, bits) in chunk.items():
+        if not habits:
+            continue
+        notes = []
+        for fn in rule_fns:
+            notes.extend(fn(habits, bits, today))
+        if notes:
+            out.append((uid, notes))
+    return out
+
+
+def evaluate_users(conn, user_ids, today, rule_fns=None):
+    """
+    Evaluate rules (default: all) for user_ids as of today and store the new
+    notes. Returns (users notified, rows inserted). Does not commit.
+    """
+    user_notes = evaluate_chunk(load_chunk(conn, user_ids, today), today, rules.RULES if rule_fns is None else rule_fns)
+    return len(user_notes), rules.store_many(conn, user_notes)
+
+
+def run(today=None, chunk_size=500, rule_names=None, restart=False, progress=True):
+    """
+    Evaluate rules for all users and store new notifications.
+    rule_names: subset of rules.RULES by function name (default: all)
+    Returns a summary dict.
+    """
+    today = today or date.today()
+    run_date = today.isoformat()
+    rule_fns = [r for r in rules.RULES if rule_names is None or r.__name__ in rule_names]
+    job = job_name(rule_names)
+    started = time.perf_counter()
+    summary = {'date': run_date, 'users': 0, 'notified_users': 0, 'inserted': 0, 'resumed_after': 0}
+    with get_pool().connection() as conn:
+        after = 0 if restart else load_checkpoint(conn, run_date, job)
+        if after is None:
+            summary['already_finished'] = True
+            summary['elapsed'] = 0.0
+            summary['users_per_sec'] = 0.0
+            return summary
+        summary['resumed_after'] = after
+        last = after
+        for ids in iter_user_chunks(conn, after, chunk_size):
+            t = time.perf_counter()
+            notified, inserted = evaluate_users(conn, ids, today, rule_fns)
+            last = ids[-1]
+            save_checkpoint(conn, run_date, last, job=job)
+            conn.commit()
+            summary['users'] += len(ids)
+            summary['notified_users'] += notified
+            summary['inserted'] += inserted
+            if progress:
+                rate = len(ids) / max(time.perf_counter() - t, 1e-9)
+                print(f"users {ids[0]}..{last}: {inserted} new notifications ({rate:.0f} users/s)", flush=True)
+        save_checkpoint(conn, run_date, last, finished=True, job=job)
+        conn.commit()
+    summary['elapsed'] = time.perf_counter() - started
+    summary['users_per_sec'] = summary['users'] / summary['elapsed'] if summary['elapsed'] else 0.0
+    return summary
+
+
+def print_summary(summary):
+    if summary.get('already_finished'):
+        print(f"Run for {summary['date']} already finished (use --restart to run again).")
+        return
+    if summary['resumed_after']:
+        print(f"Resumed after user {summary['resumed_after']}.")
+    print(f"Date: {summary['date']}  users: {summary['users']}  notified: {summary['notified_users']}  "
+          f"new notifications: {summary['inserted']}")
+    print(f"Elapsed: {summary['elapsed']:.2f}s  ({summary['users_per_sec']:.0f} users/s)")
+
+
+def main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(description='Evaluate notification rules for all users.')
+    ap.add_argument('--date', type=date.fromisoformat, default=None, help='evaluate as of this day (default: today)')
+    ap.add_argument('--chunk-size', type=int, default=500, help='users loaded per query')
+    ap.add_argument('--rule', action='append', dest='rules', choices=[r.__name__ for r in rules.RULES],
+                    help='only run this rule (repeatable)')
+    ap.add_argument('--restart', action='store_true', help='ignore the checkpoint of an unfinished run')
+    ap.add_argument('--quiet', action='store_true', help='no per-chunk progress lines')
+    args = ap.parse_args(argv)
+    summary = run(args.date, args.chunk_size, args.rules, args.restart, progress=not args.quiet)
+    print_summary(summary)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
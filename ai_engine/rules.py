@@ -1,42 +1,65 @@
 # ai_engine/rules.py
-from datetime import date, timedelta
-from collections import defaultdict
+import hashlib
+from datetime import date, datetime, timedelta
 
-def generate_notifications(db, user_id, habits, completions_map):
-    """
-    Simple rule-based notifications for a user.
-    completions_map: dict date->set(habit_id)
-    habits: list of dicts {id, name}
-    """
+# Rule registry. A rule is a function (habits, bits, today) -> list of notes,
+# where bits is an ai_engine.bitsets.HabitBits over the user's completions.
+# Rules run in registration order; add one with the @rule decorator.
+# ai_engine.notifier loads the bitsets and runs them (app and batch job).
+RULES = []
+
+def rule(fn):
+    RULES.append(fn)
+    return fn
+
+@rule
+def missed_habit(habits, bits, today):
+    """Habit done at least once in the last 14 days but not in the last 3."""
     notes = []
-    today = date.today()
-    # missed habit for last 3 days
     for h in habits:
         hid = h['id']
-        missing = 0
-        hist_count = 0
-        # check last 14 days for history
-        for i in range(1, 15):
-            d = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            if hid in completions_map.get(d, set()):
-                hist_count += 1
-        # check recent 3 days
-        for i in range(1,4):
-            d = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            if hid not in completions_map.get(d, set()):
-                missing += 1
-        if missing >= 3 and hist_count > 0:
+        recent = bits.window(hid, today - timedelta(days=14), today - timedelta(days=1))
+        # bits 0..10 are days 14..4 ago, bits 11..13 the last 3 days
+        if recent and not recent >> 11:
             notes.append({
                 'type': 'missed_habit',
-                'message': f"You missed '{h['name']}' for {missing} days. Try making it smaller (5 min) or set a reminder."
+                'message': f"You missed '{h['name']}' for 3 days. Try making it smaller (5 min) or set a reminder."
             })
-    # low consistency
-    # compute overall percent
-    all_dates = sorted(completions_map.keys())
-    if all_dates and habits:
-        total_possible = len(all_dates) * len(habits)
-        total_done = sum(len(completions_map[d]) for d in all_dates)
-        overall = int((total_done/total_possible)*100) if total_possible else 0
-        if overall < 40:
-            notes.append({'type':'low_consistency', 'message': f"Consistency is low this period ({overall}%). Try focusing on 2-3 habits."})
     return notes
+
+@rule
+def low_consistency(habits, bits, today):
+    """Overall completion rate below 40% over the days with any activity."""
+    active_days = bits.any_done().bit_count()
+    if not active_days or not habits:
+        return []
+    overall = int((bits.total() / (active_days * len(habits))) * 100)
+    if overall < 40:
+        return [{'type':'low_consistency', 'message': f"Consistency is low this period ({overall}%). Try focusing on 2-3 habits."}]
+    return []
+
+def evaluate(habits, bits, today=None):
+    """Run every registered rule over precomputed bitsets."""
+    today = today or date.today()
+    notes = []
+    for r in RULES:
+        notes.extend(r(habits, bits, today))
+    return notes
+
+def notification_key(message):
+    """Dedup key of a notification: a user gets each distinct message once."""
+    return hashlib.sha1(message.encode('utf-8')).hexdigest()
+
+def store_many(db, user_notes):
+    """
+    Store notes the users haven't received yet, in one executemany.
+    Duplicates are dropped by the unique (user_id, dedup_key) index, so this
+    doesn't depend on how many notifications a user already has.
+    user_notes: iterable of (user_id, notes). Returns rows inserted. Caller
+    commits.
+    """
+    created = datetime.utcnow().isoformat()
+    cur = db.executemany(
+        'INSERT OR IGNORE INTO notifications (user_id, message, created_at, dedup_key) VALUES (?,?,?,?)',
+        [(uid, n['message'], created, notification_key(n['message'])) for uid, notes in user_notes for n in notes])
+    return cur.rowcount
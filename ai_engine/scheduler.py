@@ -0,0 +1,143 @@
+# ai_engine/scheduler.py
+"""
+Background scheduler for per-user jobs (model retraining, notification
+rules); the app runs one instance per kind of job.
+
+Replaces the old "one thread per toggle" approach to retraining:
+- a fixed pool of worker threads pulls jobs from a bounded queue
+- at most one job per user is queued or running; repeated submits for the
+  same user are coalesced into the queued job (or into a single follow-up
+  run if the user is currently training)
+- jobs wait `debounce` seconds after the first submit so a burst of clicks
+  becomes one job
+- when the queue is full new users are rejected (submit returns False)
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class UserJobScheduler:
+
+    def __init__(self, job, name='job', workers=2, max_queue=64, debounce=2.0):
+        """
+        job: callable(user_id, submissions) run on a worker thread, where
+             submissions is how many submits were coalesced into this run
+        name: names the worker threads (<name>-N) and log messages
+        """
+        self.job = job
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.debounce = debounce
+        self._cond = threading.Condition()
+        self._pending = {}   # user_id -> [due_time, submissions]
+        self._running = set()
+        self._rerun = {}     # user_id -> submissions received while running
+        self._threads = []
+        self._stopped = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, user_id, submissions=1):
+        """
+        Queue a job for user_id. Returns False if the queue is full.
+        submissions: how many events this submit stands for (e.g. a batch of
+        completions), passed through to the job
+        """
+        with self._cond:
+            self._start_workers()
+            self.submitted += 1
+            if user_id in self._running:
+                self._rerun[user_id] = self._rerun.get(user_id, 0) + submissions
+                self.coalesced += 1
+                return True
+            entry = self._pending.get(user_id)
+            if entry is not None:
+                entry[1] += submissions
+                self.coalesced += 1
+                return True
+            if len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                return False
+            self._pending[user_id] = [time.monotonic() + self.debounce, submissions]
+            self._cond.notify()
+            return True
+
+    def _start_workers(self):
+        # called with the lock held; threads are created lazily on first submit
+        if self._threads or self._stopped:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                user_id, (due, submissions) = min(self._pending.items(), key=lambda kv: kv[1][0])
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                del self._pending[user_id]
+                self._running.add(user_id)
+                return user_id, submissions
+
+    def _worker(self):
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            user_id, submissions = item
+            try:
+                self.job(user_id, submissions)
+                ok = True
+            except Exception:
+                log.exception("%s job failed for user %s", self.name, user_id)
+                ok = False
+            with self._cond:
+                self._running.discard(user_id)
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                rerun = self._rerun.pop(user_id, 0)
+                if rerun and not self._stopped:
+                    # follow-up run bypasses max_queue: it was accepted earlier
+                    self._pending[user_id] = [time.monotonic() + self.debounce, rerun]
+                    self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'running': len(self._running),
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join()
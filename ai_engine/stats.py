@@ -1,6 +1,7 @@
 # ai_engine/stats.py
 import numpy as np
 from datetime import date, timedelta
+from ai_engine.bitsets import HabitBits
 
 def compute_stats(habits, completions_map, view_dates):
     """
@@ -9,16 +10,26 @@ def compute_stats(habits, completions_map, view_dates):
     view_dates: list of date strings (YYYY-MM-DD) for the desired period (month)
     returns habit_counts, daily_totals, overall_percent, weekly_scores
     """
-    habit_counts = [{ 'id': h['id'], 'name': h['name'], 'count': 0 } for h in habits]
-    id_to_idx = { h['id']: i for i,h in enumerate(habits) }
-    daily_totals = []
-    for d in view_dates:
-        s = completions_map.get(d, set())
-        daily_totals.append(len(s))
-        for hid in s:
-            idx = id_to_idx.get(hid)
-            if idx is not None:
-                habit_counts[idx]['count'] += 1
+    daily_totals = [len(completions_map.get(d, ())) for d in view_dates]
+    if not view_dates:
+        return _summarize(habits, {}, daily_totals, view_dates)
+    # per-habit counts from the same bitsets the rules engine uses
+    first, last = date.fromisoformat(view_dates[0]), date.fromisoformat(view_dates[-1])
+    bits = HabitBits.from_map(completions_map, first, last)
+    counts = {hid: b.bit_count() for hid, b in bits.bits.items()}
+    return _summarize(habits, counts, daily_totals, view_dates)
+
+def compute_stats_from_counts(habits, counts, day_totals, view_dates):
+    """
+    Same result as compute_stats, from pre-aggregated counts (see rollups.py)
+    counts: dict habit_id -> completions within view_dates
+    day_totals: dict date -> completions on that date (all habits)
+    """
+    daily_totals = [day_totals.get(d, 0) for d in view_dates]
+    return _summarize(habits, counts, daily_totals, view_dates)
+
+def _summarize(habits, counts, daily_totals, view_dates):
+    habit_counts = [{ 'id': h['id'], 'name': h['name'], 'count': counts.get(h['id'], 0) } for h in habits]
     total_possible = len(view_dates) * max(1, len(habits))
     total_done = sum(h['count'] for h in habit_counts)
     overall = int((total_done/total_possible)*100) if total_possible else 0
@@ -28,3 +39,68 @@ def compute_stats(habits, completions_map, view_dates):
         chunk = daily_totals[i:i+7]
         weekly.append(int((sum(chunk) / (len(chunk) * max(1,len(habits))))*100) if chunk else 0)
     return {'habit_counts': habit_counts, 'daily_totals': daily_totals, 'overall_percent': overall, 'weekly': weekly}
+
+def _percent(done, possible):
+    return int((done / possible) * 100) if possible else 0
+
+def compute_range_stats(habits, month_sizes, completions, first, last):
+    """
+    Aggregates for an arbitrary date range in one pass (np.bincount over day,
+    habit, ISO week and month indexes).
+    habits: list of dicts {id,name} (snapshot habits of the range's months)
+    month_sizes: dict 'YYYY-MM' -> number of snapshot habits that month,
+                 used for the possible completions of each day
+    completions: list of (habit_id, date) with first <= date <= last
+    first, last: date strings (YYYY-MM-DD)
+    """
+    f, l = np.datetime64(first, 'D'), np.datetime64(last, 'D')
+    n = int((l - f).astype(np.int64)) + 1
+    days = f + np.arange(n)
+
+    if completions:
+        hids = np.fromiter((c[0] for c in completions), dtype=np.int64, count=len(completions))
+        day_idx = (np.array([c[1] for c in completions], dtype='datetime64[D]') - f).astype(np.int64)
+    else:
+        hids = day_idx = np.zeros(0, dtype=np.int64)
+    daily = np.bincount(day_idx, minlength=n)
+
+    # per habit: position of each completion's habit in the sorted id list
+    ids = np.array(sorted(h['id'] for h in habits), dtype=np.int64)
+    pos = np.searchsorted(ids, hids)
+    known = pos < len(ids)
+    known[known] = ids[pos[known]] == hids[known]
+    habit_counts = np.bincount(pos[known], minlength=len(ids))
+    by_id = dict(zip(ids.tolist(), habit_counts.tolist()))
+
+    # possible completions per day = habits in that day's month snapshot
+    months = days.astype('datetime64[M]')
+    month_idx = (months - months[0]).astype(np.int64)
+    month_labels = [str(m) for m in months[0] + np.arange(month_idx[-1] + 1)]
+    possible = np.array([month_sizes.get(m, 0) for m in month_labels], dtype=np.int64)[month_idx]
+    monthly_done = np.bincount(month_idx, weights=daily)
+    monthly_possible = np.bincount(month_idx, weights=possible)
+
+    # ISO weeks start on Monday; day 0 of the epoch (1970-01-01) was a Thursday
+    week_no = (days.astype(np.int64) + 3) // 7
+    week_idx = week_no - week_no[0]
+    weekly_done = np.bincount(week_idx, weights=daily)
+    weekly_possible = np.bincount(week_idx, weights=possible)
+    week_starts = (week_no[0] + np.arange(week_idx[-1] + 1)) * 7 - 3
+
+    weekly = []
+    for i, start in enumerate(week_starts.tolist()):
+        y, w, _ = (date(1970, 1, 1) + timedelta(days=start)).isocalendar()
+        weekly.append({'week': f'{y}-W{w:02d}', 'count': int(weekly_done[i]),
+                       'percent': _percent(weekly_done[i], weekly_possible[i])})
+    monthly = [{'month': m, 'count': int(monthly_done[i]), 'percent': _percent(monthly_done[i], monthly_possible[i])}
+               for i, m in enumerate(month_labels)]
+    return {
+        'from': first,
+        'to': last,
+        'total': int(daily.sum()),
+        'overall_percent': _percent(daily.sum(), possible.sum()),
+        'habit_counts': [{'id': h['id'], 'name': h['name'], 'count': by_id.get(h['id'], 0)} for h in habits],
+        'daily_totals': daily.tolist(),
+        'weekly': weekly,
+        'monthly': monthly,
+    }
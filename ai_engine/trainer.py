@@ -8,54 +8,156 @@ Features (example):
 - streak_length
 Target:
 - whether the habit was completed the NEXT DAY (binary)
+
+CLI:
+  python -m ai_engine.trainer <user_id>           train one user
+  python -m ai_engine.trainer --all [--workers N]  train every user in a process pool
+  python -m ai_engine.trainer --stale              only users with new completions since their last model
 """
-import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-from ai_engine.ml_model import train_model_for_user, model_path_for
+from datetime import datetime
+from ai_engine.ml_model import train_model_for_user, update_model_for_user, model_path_for, feature_state_path_for, ensure_model_dir
+from ai_engine import features
+from database import get_pool, reset_retrain_counter
+import metrics
+import joblib
 import os
 
-DB = 'habit_tracker.db'
+# every this many incremental retrains, refit from the whole history (picks up
+# edits to dates that were already trained on)
+FULL_REFIT_EVERY = int(os.environ.get('HABIT_FULL_REFIT_EVERY', '50'))
 
-def build_user_dataset(user_id):
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
+TRAIN_SECONDS = metrics.histogram('habit_train_seconds', 'Per-user model training time (features + fit).',
+                                  ('mode',), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+def load_user_history(conn, user_id):
+    """Return (habit ids, completions map date->set(habit_id)) for a user."""
     cur = conn.cursor()
     # load habits
-    cur.execute('SELECT id FROM habits WHERE user_id = ?', (user_id,))
-    habits = [r['id'] for r in cur.fetchall()]
+    cur.execute('SELECT id FROM habits WHERE user_id = ? ORDER BY id', (user_id,))
+    habits = [r[0] for r in cur.fetchall()]
     # load completions (date strings)
     cur.execute('SELECT habit_id, date FROM completions WHERE user_id = ?', (user_id,))
-    rows = cur.fetchall()
     comp = {}
-    for r in rows:
-        comp.setdefault(r['date'], set()).add(r['habit_id'])
-    # flatten into rows per habit-date
+    for hid, d in cur.fetchall():
+        comp.setdefault(d, set()).add(hid)
+    return habits, comp
+
+def build_feature_frame(habits, comp, tail=None, offset=0, streak=None):
+    """
+    One row per (date, habit) for every date that has any completion, in
+    date-major order. recent7 and streak are measured over those dates (not
+    calendar days), matching the original per-cell loop.
+
+    To extend a table built earlier for the same habits from all dates before
+    the ones in `comp`, pass its running aggregates (see feature_state):
+    tail: its last (up to 7) rows of the done matrix, offset: its number of
+    dates, streak: its last row of streaks. Only rows for the new dates are
+    returned.
+    """
     all_dates = sorted(comp.keys())
-    rows_out = []
-    for i, d in enumerate(all_dates):
-        for hid in habits:
-            done = 1 if hid in comp.get(d, set()) else 0
-            # compute recent 7-day completion rate for this habit (including this day)
-            prev7 = []
-            for j in range(7):
-                idx = i - j
-                if idx < 0: break
-                dt = all_dates[idx]
-                prev7.append(1 if hid in comp.get(dt, set()) else 0)
-            recent7 = sum(prev7)/len(prev7) if prev7 else 0
-            # day of week
-            dow = datetime.strptime(d, '%Y-%m-%d').weekday()
-            # streak (consecutive days up to this day)
-            streak = 0
-            k = i
-            while k >= 0 and hid in comp.get(all_dates[k], set()):
-                streak += 1
-                k -= 1
-            rows_out.append({'date': d, 'habit_id': hid, 'done': done, 'recent7': recent7, 'dow': dow, 'streak': streak})
-    df = pd.DataFrame(rows_out)
-    conn.close()
-    return df
+    if not all_dates or not habits:
+        return pd.DataFrame()
+    m = features.completion_matrix(all_dates, habits, comp)
+    n, k = m.shape
+    prefix = tail[-6:] if tail is not None else None
+    return pd.DataFrame({
+        'date': np.repeat(np.array(all_dates, dtype=object), k),
+        'habit_id': np.tile(np.asarray(habits, dtype=np.int64), n),
+        'done': m.astype(np.int64).ravel(),
+        'recent7': features.trailing_rate(m, 7, prefix=prefix, offset=offset).ravel(),
+        'dow': np.repeat(features.weekdays(all_dates), k),
+        'streak': features.run_lengths(m, initial=streak).ravel(),
+    })
+
+def build_user_dataset(user_id):
+    with get_pool().connection() as conn:
+        habits, comp = load_user_history(conn, user_id)
+    return build_feature_frame(habits, comp)
+
+def feature_state(habits, df, last_id, runs=0):
+    """
+    Running aggregates at the end of a feature table: all an incremental
+    retrain needs to extend it (a few KB, whatever the history length).
+    """
+    k = len(habits)
+    done = df['done'].to_numpy().reshape(-1, k).astype(bool)
+    return {'habits': list(habits), 'last_date': df['date'].iloc[-1], 'rows': done.shape[0],
+            'tail': done[-7:], 'streak': df['streak'].to_numpy()[-k:], 'last_id': last_id, 'runs': runs}
+
+def remap_state(state, habits):
+    """State columns for the current habit list: new habits start empty, deleted ones are dropped."""
+    if habits == state['habits']:
+        return state
+    cols = {hid: j for j, hid in enumerate(state['habits'])}
+    tail = np.zeros((state['tail'].shape[0], len(habits)), dtype=bool)
+    streak = np.zeros(len(habits), dtype=np.int64)
+    for j, hid in enumerate(habits):
+        if hid in cols:
+            tail[:, j] = state['tail'][:, cols[hid]]
+            streak[j] = state['streak'][cols[hid]]
+    return dict(state, habits=list(habits), tail=tail, streak=streak)
+
+def last_rows(state):
+    """Feature rows of the last trained date; their targets come with the next date."""
+    habits, tail = state['habits'], state['tail']
+    k = len(habits)
+    return pd.DataFrame({
+        'date': np.repeat(np.array([state['last_date']], dtype=object), k),
+        'habit_id': np.asarray(habits, dtype=np.int64),
+        'done': tail[-1].astype(np.int64),
+        # tail holds min(rows, 7) rows, the same window trailing_rate uses
+        'recent7': tail.mean(axis=0),
+        'dow': np.repeat(features.weekdays([state['last_date']]), k),
+        'streak': np.asarray(state['streak'], dtype=np.int64),
+    })
+
+def update_user_dataset(conn, user_id, state):
+    """
+    Training rows for completions dated after state['last_date']: the rows of
+    the last trained date (now that their targets are known) followed by the
+    new dates' rows, built from the state's running aggregates. Only the new
+    completions are read. Returns (frame, new state); the frame is empty when
+    there is nothing new.
+    """
+    habits = [r[0] for r in conn.execute('SELECT id FROM habits WHERE user_id = ? ORDER BY id', (user_id,))]
+    state = remap_state(state, habits)
+    comp = {}
+    last_id = state['last_id']
+    for cid, hid, d in conn.execute('SELECT id, habit_id, date FROM completions WHERE user_id = ? AND date > ?',
+                                    (user_id, state['last_date'])):
+        comp.setdefault(d, set()).add(hid)
+        last_id = max(last_id, cid)
+    new = build_feature_frame(habits, comp, tail=state['tail'], offset=state['rows'], streak=state['streak'])
+    if new.empty:
+        return new, state
+    k = len(habits)
+    done = new['done'].to_numpy().reshape(-1, k).astype(bool)
+    new_state = dict(state, last_date=new['date'].iloc[-1], rows=state['rows'] + done.shape[0],
+                     tail=np.vstack([state['tail'], done])[-7:], streak=new['streak'].to_numpy()[-k:],
+                     last_id=last_id, runs=state.get('runs', 0) + 1)
+    return pd.concat([last_rows(state), new], ignore_index=True), new_state
+
+def load_feature_state(user_id):
+    path = feature_state_path_for(user_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        state = joblib.load(path)
+    except Exception:
+        return None
+    # feature tables saved by older versions are rebuilt
+    return state if isinstance(state, dict) and 'tail' in state else None
+
+def save_feature_state(user_id, state):
+    ensure_model_dir()
+    path = feature_state_path_for(user_id)
+    tmp = path + '.tmp'
+    joblib.dump(state, tmp)
+    os.replace(tmp, path)
 
 def prepare_features_and_target(df):
     # target is next-day completion for same habit
@@ -63,28 +165,234 @@ def prepare_features_and_target(df):
     df['next_done'] = df.groupby('habit_id')['done'].shift(-1)
     df = df.dropna(subset=['next_done'])
     X = df[['recent7','dow','streak']].copy()
-    # one-hot encode dow
+    # one-hot encode dow; always emit all 7 columns so models stay comparable
     X = pd.get_dummies(X, columns=['dow'], prefix='dow')
+    X = X.reindex(columns=features.FEATURE_COLUMNS, fill_value=0)
     y = df['next_done'].astype(int)
     return X, y
 
-def train_for_user(user_id):
-    df = build_user_dataset(user_id)
-    if df.empty:
-        return None
+def record_model(conn, user_id, path, last_completion_id, seconds):
+    """Upsert the user's row in ml_models."""
+    conn.execute("""
+        INSERT INTO ml_models (user_id, model_path, updated_at, last_completion_id, train_seconds)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            model_path = excluded.model_path,
+            updated_at = excluded.updated_at,
+            last_completion_id = excluded.last_completion_id,
+            train_seconds = excluded.train_seconds
+    """, (user_id, path, datetime.utcnow().isoformat(), last_completion_id, seconds))
+    conn.commit()
+
+def fit_and_save(user_id, df, habits, last_id):
+    """Fit a new model on a whole feature table and persist model + feature state."""
     X, y = prepare_features_and_target(df)
     path = train_model_for_user(user_id, X, y)
+    save_feature_state(user_id, feature_state(habits, df, last_id))
     return path
 
+def train_incremental(user_id, state):
+    """
+    Update the user's model with the rows for dates after the last trained
+    one. Returns (model path, last completion id); the path is None if a
+    full fit is needed (no updatable model saved).
+    """
+    with get_pool().connection() as conn:
+        df, new_state = update_user_dataset(conn, user_id, state)
+    if df.empty:
+        # nothing new since the last run
+        path = model_path_for(user_id)
+        return (path if os.path.exists(path) else None), state['last_id']
+    X, y = prepare_features_and_target(df)
+    path = update_model_for_user(user_id, X, y)
+    if path:
+        save_feature_state(user_id, new_state)
+    return path, new_state['last_id']
+
+def train_for_user(user_id, incremental=True):
+    """
+    Fit the user's model.
+
+    With incremental=True and a feature state from an earlier run, only the
+    completions dated after the last trained date are read, their feature
+    rows are built from the saved running aggregates (last 7 rows of the
+    completion matrix, streaks, row count) and the model is updated with
+    partial_fit on those rows, so the cost scales with the new data. Edits to
+    dates that were already trained on are not seen by these runs; every
+    FULL_REFIT_EVERY incremental runs (and on any full run, e.g. the
+    importer or train_all) the model is refitted from the whole history.
+    """
+    started = time.perf_counter()
+    state = load_feature_state(user_id) if incremental else None
+    if state is not None and state.get('runs', 0) < FULL_REFIT_EVERY:
+        path, last_id = train_incremental(user_id, state)
+        if path:
+            seconds = time.perf_counter() - started
+            TRAIN_SECONDS.observe(seconds, 'incremental')
+            with get_pool().connection() as conn:
+                record_model(conn, user_id, path, last_id, seconds)
+            return path
+    with get_pool().connection() as conn:
+        # one read transaction so last_id matches the rows we loaded
+        conn.execute('BEGIN')
+        habits, comp = load_user_history(conn, user_id)
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM completions WHERE user_id = ?', (user_id,)).fetchone()[0]
+        conn.rollback()
+    df = build_feature_frame(habits, comp)
+    if df.empty:
+        return None
+    # fit without holding a pooled connection
+    path = fit_and_save(user_id, df, habits, last_id)
+    seconds = time.perf_counter() - started
+    TRAIN_SECONDS.observe(seconds, 'full')
+    if path:
+        with get_pool().connection() as conn:
+            record_model(conn, user_id, path, last_id, seconds)
+    return path
+
+
+# ---------- Batch training ----------
+def list_users(conn, stale_only=False):
+    """All user ids, or only those with completions newer than their last model."""
+    if not stale_only:
+        return [r[0] for r in conn.execute('SELECT id FROM users ORDER BY id')]
+    return [r[0] for r in conn.execute("""
+        SELECT u.id FROM users u
+        LEFT JOIN ml_models m ON m.user_id = u.id
+        WHERE EXISTS (SELECT 1 FROM completions c
+                      WHERE c.user_id = u.id AND c.id > COALESCE(m.last_completion_id, 0))
+        ORDER BY u.id
+    """)]
+
+def iter_user_histories(conn, user_ids, chunk_size=200):
+    """
+    Yield (user_id, habits, comp, last_completion_id) for each user, loading
+    habits and completions for `chunk_size` users per query.
+    """
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        marks = ','.join('?' * len(chunk))
+        habits = {uid: [] for uid in chunk}
+        for uid, hid in conn.execute(f'SELECT user_id, id FROM habits WHERE user_id IN ({marks}) ORDER BY user_id, id', chunk):
+            habits[uid].append(hid)
+        comps = {uid: {} for uid in chunk}
+        last_ids = {uid: 0 for uid in chunk}
+        cur = conn.execute(f'SELECT user_id, id, habit_id, date FROM completions WHERE user_id IN ({marks})', chunk)
+        while True:
+            rows = cur.fetchmany(5000)
+            if not rows:
+                break
+            for uid, cid, hid, d in rows:
+                comps[uid].setdefault(d, set()).add(hid)
+                last_ids[uid] = max(last_ids[uid], cid)
+        for uid in chunk:
+            yield uid, habits[uid], comps[uid], last_ids[uid]
+
+def _train_from_history(user_id, habits, comp, last_id):
+    """Process-pool worker: returns (user_id, path or None, seconds, error)."""
+    started = time.perf_counter()
+    try:
+        df = build_feature_frame(habits, comp)
+        path = fit_and_save(user_id, df, habits, last_id) if not df.empty else None
+        return user_id, path, time.perf_counter() - started, None
+    except Exception as e:
+        return user_id, None, time.perf_counter() - started, f'{type(e).__name__}: {e}'
+
+def train_all(workers=None, stale_only=False, chunk_size=200, progress=True):
+    """
+    Retrain many users across a process pool. Histories are streamed from a
+    single read connection; results are written to ml_models.
+    Returns a summary dict.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    db_pool = get_pool()
+    read_conn = db_pool.acquire()
+    write_conn = db_pool.acquire()
+    user_ids = list_users(read_conn, stale_only)
+    total = len(user_ids)
+    summary = {'users': total, 'trained': 0, 'skipped': 0, 'failed': 0, 'failures': [], 'timings': []}
+    last_ids = {}
+    done = 0
+
+    def collect(fut):
+        nonlocal done
+        uid, path, seconds, error = fut.result()
+        done += 1
+        if error:
+            summary['failed'] += 1
+            summary['failures'].append({'user_id': uid, 'error': error})
+        elif path:
+            summary['trained'] += 1
+            summary['timings'].append((seconds, uid))
+            TRAIN_SECONDS.observe(seconds, 'batch')
+            record_model(write_conn, uid, path, last_ids.pop(uid, 0), seconds)
+            reset_retrain_counter(write_conn, uid)
+        else:
+            summary['skipped'] += 1
+        if progress:
+            status = 'failed' if error else ('ok' if path else 'no data')
+            print(f"[{done}/{total}] user {uid}: {status} ({seconds:.2f}s)", flush=True)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # bound the number of histories held in memory at once
+            max_in_flight = workers * 4
+            pending = set()
+            for uid, habits, comp, last_id in iter_user_histories(read_conn, user_ids, chunk_size):
+                last_ids[uid] = last_id
+                pending.add(pool.submit(_train_from_history, uid, habits, comp, last_id))
+                if len(pending) >= max_in_flight:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        collect(fut)
+            for fut in as_completed(pending):
+                collect(fut)
+    finally:
+        db_pool.release(read_conn)
+        db_pool.release(write_conn)
+
+    times = sorted(t for t, _ in summary['timings'])
+    summary['elapsed'] = time.perf_counter() - started
+    summary['mean_seconds'] = sum(times) / len(times) if times else 0.0
+    summary['p95_seconds'] = times[int(0.95 * (len(times) - 1))] if times else 0.0
+    summary['slowest'] = [{'user_id': uid, 'seconds': t} for t, uid in sorted(summary.pop('timings'), reverse=True)[:5]]
+    return summary
+
+def print_summary(summary):
+    print(f"Users: {summary['users']}  trained: {summary['trained']}  "
+          f"no data: {summary['skipped']}  failed: {summary['failed']}")
+    print(f"Elapsed: {summary['elapsed']:.1f}s  per user mean: {summary['mean_seconds']:.2f}s  "
+          f"p95: {summary['p95_seconds']:.2f}s")
+    for s in summary['slowest']:
+        print(f"  slow: user {s['user_id']} {s['seconds']:.2f}s")
+    for f in summary['failures']:
+        print(f"  failed: user {f['user_id']}: {f['error']}")
+
 if __name__ == '__main__':
     # quick CLI
+    import argparse
     import sys
-    if len(sys.argv) < 2:
-        print("Usage: python trainer.py <user_id>")
-        sys.exit(1)
-    uid = int(sys.argv[1])
-    p = train_for_user(uid)
-    if p:
-        print("Trained model:", p)
+    ap = argparse.ArgumentParser(description='Train per-user habit models.')
+    ap.add_argument('user_id', type=int, nargs='?', help='train a single user')
+    ap.add_argument('--all', action='store_true', help='train every user')
+    ap.add_argument('--stale', action='store_true', help='only users with new completions since their last model')
+    ap.add_argument('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+    ap.add_argument('--chunk-size', type=int, default=200, help='users loaded per query')
+    ap.add_argument('--quiet', action='store_true', help='no per-user progress lines')
+    args = ap.parse_args()
+
+    if args.user_id is not None:
+        p = train_for_user(args.user_id)
+        if p:
+            print("Trained model:", p)
+        else:
+            print("Not enough data to train")
+    elif args.all or args.stale:
+        summary = train_all(workers=args.workers, stale_only=args.stale,
+                            chunk_size=args.chunk_size, progress=not args.quiet)
+        print_summary(summary)
+        sys.exit(1 if summary['failed'] else 0)
     else:
-        print("Not enough data to train")
+        ap.print_usage()
+        sys.exit(1)
@@ -1,23 +1,84 @@
 # app.py
+import csv
+import io
+import json
+import logging
 import os
-import sqlite3
-import threading
+import time
 from datetime import datetime, date, timedelta
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from database import get_db, close_db
-from ai_engine import rules, stats, ml_model
-from ai_engine.trainer import train_for_user
+from database import (get_db, close_db, get_pool, close_pool, pool_stats, PoolTimeout, month_version, bump_month_version,
+                      bump_retrain_counter, claim_retrain, release_retrain, mark_trained, db_epoch)
+import importer
+import metrics
+import rollups
+# ai_engine.trainer (pandas, sklearn, joblib) is imported lazily by maybe_retrain;
+# nothing imported here at module load should pull in those packages
+from ai_engine import stats, ml_model, features, notifier
+from ai_engine.scheduler import UserJobScheduler
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = os.urandom(24)
 
-# Make sure DB connection closes at end of request
+# Make sure DB connection returns to the pool at end of request
 app.teardown_appcontext(close_db)
 
 
+log = logging.getLogger(__name__)
+slow_log = logging.getLogger('habit.slow_requests')
+
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({'error': 'database busy'}), 503
+
+
+# ---------- Request metrics (exposed at /metrics) ----------
+# Requests slower than this are logged with their slowest queries (0 = off)
+SLOW_REQUEST_MS = float(os.environ.get('HABIT_SLOW_REQUEST_MS', '500'))
+
+REQUEST_SECONDS = metrics.histogram('habit_request_seconds', 'Request latency by route.', ('route', 'method', 'status'))
+REQUEST_QUERIES = metrics.histogram('habit_request_sql_queries', 'SQL statements executed per request.', ('route',),
+                                    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500))
+REQUEST_SQL_SECONDS = metrics.histogram('habit_request_sql_seconds', 'Time spent in SQL per request.', ('route',))
+
+
+@app.before_request
+def start_request_metrics():
+    sql_stats, token = metrics.start_tracking()
+    g._request_metrics = (time.perf_counter(), sql_stats, token)
+
+
+@app.after_request
+def record_request_metrics(resp):
+    started, sql_stats, _ = g.get('_request_metrics', (None, None, None))
+    if started is None:
+        return resp
+    elapsed = time.perf_counter() - started
+    # the URL rule, not the path, so ids don't explode the label set
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, route, request.method, str(resp.status_code))
+    REQUEST_QUERIES.observe(sql_stats.queries, route)
+    REQUEST_SQL_SECONDS.observe(sql_stats.sql_seconds, route)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        lines = [f"slow request {request.method} {request.path} {resp.status_code}: {elapsed * 1000:.0f} ms "
+                 f"(sql {sql_stats.sql_seconds * 1000:.0f} ms in {sql_stats.queries} queries)"]
+        for seconds, sql in sql_stats.slowest():
+            lines.append(f"  {seconds * 1000:8.1f} ms  {' '.join(sql.split())[:200]}")
+        slow_log.warning('\n'.join(lines))
+    return resp
+
+
+@app.teardown_request
+def stop_request_metrics(exc):
+    state = g.pop('_request_metrics', None)
+    if state is not None:
+        metrics.stop_tracking(state[2])
+
+
 # ---------- Helpers ----------
 def login_user(user_row):
     session['user_id'] = user_row['id']
@@ -174,6 +235,7 @@ def api_add_habit():
     month_str = date.today().strftime("%Y-%m")
     db.execute("INSERT INTO habit_snapshots (user_id, habit_id, name_at_that_time, month) VALUES (?, ?, ?, ?)",
                (uid, hid, name, month_str))
+    bump_month_version(db, uid, month_str)
 
     db.commit()
     return jsonify({"success": True, "habit_id": hid})
@@ -193,6 +255,7 @@ def api_delete_habit(hid):
     month_str = date.today().strftime("%Y-%m")
 
     db.execute("DELETE FROM habit_snapshots WHERE user_id = ? AND habit_id = ? AND month = ?", (uid, hid, month_str))
+    bump_month_version(db, uid, month_str)
     db.commit()
     return jsonify({"success": True})
 
@@ -217,6 +280,7 @@ def api_rename_habit(hid):
     # Update only snapshot row for current month
     db.execute("UPDATE habit_snapshots SET name_at_that_time = ? WHERE user_id = ? AND habit_id = ? AND month = ?",
                (name, uid, hid, month_str))
+    bump_month_version(db, uid, month_str)
     db.commit()
     return jsonify({"success": True})
 
@@ -237,44 +301,333 @@ def api_toggle_completion():
     date_str = data.get('date')
     if not hid or not date_str:
         return jsonify({'error': 'habit_id & date required'}), 400
+    # rollup buckets need a canonical date (2026-1-5 -> 2026-01-05), like the batch endpoint
+    try:
+        date_str = datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    # completions reference habits (foreign keys are enforced), and only the
+    # user's own habits may be toggled
+    if db.execute('SELECT 1 FROM habits WHERE id = ? AND user_id = ?', (hid, uid)).fetchone() is None:
+        return jsonify({'error': 'unknown habit'}), 404
 
     # Ensure snapshot for that date's month exists (no copying)
     ensure_snapshot_for_date(uid, date_str)
 
-    # Toggle
-    row = db.execute('SELECT id FROM completions WHERE user_id = ? AND habit_id = ? AND date = ?', (uid, hid, date_str)).fetchone()
-    if row:
-        db.execute('DELETE FROM completions WHERE id = ?', (row['id'],))
+    # Toggle. Take the write lock before reading, as the batch endpoint does,
+    # so overlapping toggles (double clicks, a concurrent batch) see each
+    # other's result and the rollup deltas are applied once.
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT id FROM completions WHERE user_id = ? AND habit_id = ? AND date = ?', (uid, hid, date_str)).fetchone()
+        if row:
+            db.execute('DELETE FROM completions WHERE id = ?', (row['id'],))
+            record_completion_changes(db, uid, removed=[(hid, date_str)])
+        else:
+            db.execute('INSERT INTO completions (user_id, habit_id, date) VALUES (?,?,?)', (uid, hid, date_str))
+            since_train = record_completion_changes(db, uid, added=[(hid, date_str)])
         db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    schedule_rules(uid, [date_str])
+    if row:
         return jsonify({'status': 'removed'})
-    else:
+    # Retrain ML periodically (asynchronous, coalesced per user)
+    if since_train >= RETRAIN_THRESHOLD:
+        retrain_scheduler.submit(uid)
+    return jsonify({'status': 'added'})
+
+
+# Retrain a user's model after this many new completions
+RETRAIN_THRESHOLD = int(os.environ.get('HABIT_RETRAIN_THRESHOLD', '20'))
+
+
+def record_completion_changes(db, uid, added=(), removed=()):
+    """
+    Keep the rollups, month versions and retrain counter in step with
+    inserted/deleted completions. added/removed: lists of (habit_id, date).
+    Returns the user's completions-since-last-train count. Caller commits,
+    then calls schedule_rules with the touched dates.
+    """
+    deltas = [(h, d, 1) for h, d in added] + [(h, d, -1) for h, d in removed]
+    rollups.apply_completion_deltas(db, uid, deltas)
+    for month_str in sorted({d[:7] for _, d, _ in deltas}):
+        bump_month_version(db, uid, month_str)
+    # only additions count towards retraining; deletes don't shift the trigger
+    return bump_retrain_counter(db, uid, len(added)) if added else 0
+
+
+MAX_BATCH_OPS = 1000
+
+
+@app.route('/api/completions/batch', methods=['POST'])
+def api_batch_completions():
+    """
+    Apply many set/unset operations in one transaction (bulk check-ins,
+    offline sync). Body:
+      {"ops": [{"habit_id": 3, "date": "2025-11-03", "done": true}, ...]}
+    Ops are applied in order, so a later op on the same habit/date wins.
+    Returns one result per op: added / removed / unchanged / error.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    uid = session['user_id']
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'ops list required'}), 400
+    if len(ops) > MAX_BATCH_OPS:
+        return jsonify({'error': f'at most {MAX_BATCH_OPS} ops per batch'}), 413
+
+    # validate shapes first
+    results = [None] * len(ops)
+    parsed = []
+    for i, op in enumerate(ops):
         try:
-            db.execute('INSERT INTO completions (user_id, habit_id, date) VALUES (?,?,?)', (uid, hid, date_str))
-            db.commit()
-        except sqlite3.IntegrityError:
-            # Unique constraint may fail if duplicated concurrently
-            pass
-        # Optionally retrain ML periodically (asynchronous)
-        threading.Thread(target=maybe_retrain, args=(uid,)).start()
-        return jsonify({'status': 'added'})
-
-
-def maybe_retrain(user_id):
-    # Retrain model every N completions (simple heuristic)
-    # Use a direct sqlite connection to avoid app context issues from background thread
+            hid = int(op['habit_id'])
+            date_str = datetime.strptime(op['date'], '%Y-%m-%d').strftime('%Y-%m-%d')
+            done = op.get('done', True)
+            if not isinstance(done, bool):
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            results[i] = {'status': 'error', 'error': 'habit_id, date (YYYY-MM-DD) and boolean done required'}
+            continue
+        parsed.append((i, hid, date_str, done))
+
+    db = get_db()
+    # take the write lock up front so the state we read can't change under us
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        hids = sorted({hid for _, hid, _, _ in parsed})
+        owned = set()
+        if hids:
+            marks = ','.join('?' * len(hids))
+            owned = {r[0] for r in db.execute(f'SELECT id FROM habits WHERE user_id = ? AND id IN ({marks})', [uid] + hids).fetchall()}
+        dates = [d for _, _, d, _ in parsed]
+        present = set()
+        if dates:
+            rows = db.execute('SELECT habit_id, date FROM completions WHERE user_id = ? AND date BETWEEN ? AND ?', (uid, min(dates), max(dates))).fetchall()
+            present = {(r['habit_id'], r['date']) for r in rows if r['habit_id'] in owned}
+        initial = set(present)
+        for i, hid, date_str, done in parsed:
+            if hid not in owned:
+                results[i] = {'status': 'error', 'error': 'unknown habit'}
+                continue
+            key = (hid, date_str)
+            if done and key not in present:
+                present.add(key)
+                results[i] = {'status': 'added'}
+            elif not done and key in present:
+                present.discard(key)
+                results[i] = {'status': 'removed'}
+            else:
+                results[i] = {'status': 'unchanged'}
+        added = sorted(present - initial)
+        removed = sorted(initial - present)
+        db.executemany('INSERT INTO completions (user_id, habit_id, date) VALUES (?,?,?)', [(uid, h, d) for h, d in added])
+        db.executemany('DELETE FROM completions WHERE user_id = ? AND habit_id = ? AND date = ?', [(uid, h, d) for h, d in removed])
+        since_train = record_completion_changes(db, uid, added=added, removed=removed)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for i, r in enumerate(results):
+        r['habit_id'] = ops[i].get('habit_id') if isinstance(ops[i], dict) else None
+        r['date'] = ops[i].get('date') if isinstance(ops[i], dict) else None
+    if since_train >= RETRAIN_THRESHOLD:
+        # one retrain for the whole batch
+        retrain_scheduler.submit(uid, len(added))
+    if added or removed:
+        schedule_rules(uid, [d for _, d in added + removed])
+    return jsonify({'results': results, 'added': len(added), 'removed': len(removed)})
+
+
+RETRAIN_ERRORS = metrics.counter('habit_retrain_errors_total', 'Retrain jobs that raised, by stage.', ('stage',))
+
+
+def maybe_retrain(user_id, submissions=1):
+    # Retrain once the user's counter reaches RETRAIN_THRESHOLD. The counter is
+    # maintained by the toggle/batch transactions, so this is a primary-key
+    # update rather than a COUNT(*) over the user's history.
+    # Use a pooled connection (not get_db) to avoid app context issues from background thread
     try:
-        con = sqlite3.connect('habit_tracker.db')
-        c = con.cursor()
-        c.execute('SELECT COUNT(*) FROM completions WHERE user_id = ?', (user_id,))
-        count = c.fetchone()[0]
-        con.close()
-        if count >= 20 and count % 20 == 0:
+        with get_pool().connection() as con:
+            claimed = claim_retrain(con, user_id, RETRAIN_THRESHOLD)
+        if claimed:
             try:
+                from ai_engine.trainer import train_for_user
                 train_for_user(user_id)
-            except Exception as e:
-                print("Retrain failed:", e)
-    except Exception as e:
-        print("Retrain check error:", e)
+            except Exception:
+                RETRAIN_ERRORS.inc('train')
+                log.exception("Retrain failed for user %s", user_id)
+                # put the count back so the next write triggers another attempt
+                with get_pool().connection() as con:
+                    release_retrain(con, user_id, claimed)
+            else:
+                with get_pool().connection() as con:
+                    mark_trained(con, user_id)
+    except Exception:
+        RETRAIN_ERRORS.inc('check')
+        log.exception("Retrain check failed for user %s", user_id)
+
+
+# Single background scheduler shared by all requests (see ai_engine/scheduler.py)
+retrain_scheduler = UserJobScheduler(
+    maybe_retrain,
+    name='retrain',
+    workers=int(os.environ.get('HABIT_RETRAIN_WORKERS', '2')),
+    max_queue=int(os.environ.get('HABIT_RETRAIN_QUEUE', '64')),
+    debounce=float(os.environ.get('HABIT_RETRAIN_DEBOUNCE', '2.0')),
+)
+
+
+RULE_ERRORS = metrics.counter('habit_rule_errors_total', 'Notification rule jobs that raised.')
+
+
+def schedule_rules(uid, dates=None):
+    """
+    Re-run the notification rules for a user in the background, after the
+    caller's commit, if a changed date (YYYY-MM-DD; None = always) is in the
+    window the rules look at. Submits for the same user are coalesced, so a
+    burst of toggles is one evaluation. If the queue is full the daily
+    notifier picks the user up.
+    """
+    first, last = notifier.window(date.today())
+    if dates is None or any(first.isoformat() <= d <= last.isoformat() for d in dates):
+        rules_scheduler.submit(uid)
+
+
+def run_rules(user_id, submissions=1):
+    # same loader, window and messages as the daily notifier job
+    try:
+        with get_pool().connection() as con:
+            notifier.evaluate_users(con, [user_id], date.today())
+            con.commit()
+    except Exception:
+        RULE_ERRORS.inc()
+        log.exception("Rule evaluation failed for user %s", user_id)
+
+
+rules_scheduler = UserJobScheduler(
+    run_rules,
+    name='rules',
+    workers=1,
+    max_queue=int(os.environ.get('HABIT_RULES_QUEUE', '256')),
+    debounce=float(os.environ.get('HABIT_RULES_DEBOUNCE', '1.0')),
+)
+
+
+# ------------------------------
+# Shared month/completion loaders (used by the single endpoints and the bundle)
+# ------------------------------
+PREDICT_WINDOW_DAYS = 30
+
+
+def load_month_habits(db, uid, month_str):
+    """Snapshot habits of a month as [{id, name}], ordered by habit id."""
+    return [dict(r) for r in db.execute(
+        'SELECT habit_id as id, name_at_that_time as name FROM habit_snapshots WHERE user_id = ? AND month = ? ORDER BY habit_id',
+        (uid, month_str)).fetchall()]
+
+
+def load_completion_map(db, uid, ranges):
+    """
+    dict date->set(habit_id) for the given (start, end) date-string ranges.
+    Overlapping or adjacent ranges are merged so each date is read once.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged:
+            prev_end = datetime.strptime(merged[-1][1], '%Y-%m-%d').date()
+            if datetime.strptime(start, '%Y-%m-%d').date() <= prev_end + timedelta(days=1):
+                merged[-1][1] = max(merged[-1][1], end)
+                continue
+        merged.append([start, end])
+    comp_map = {}
+    for start, end in merged:
+        rows = db.execute('SELECT habit_id, date FROM completions WHERE user_id = ? AND date BETWEEN ? AND ?', (uid, start, end)).fetchall()
+        for r in rows:
+            comp_map.setdefault(r['date'], set()).add(r['habit_id'])
+    return comp_map
+
+
+def prediction_window(today):
+    start = today - timedelta(days=PREDICT_WINDOW_DAYS)
+    return start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+
+
+NOTIFICATIONS_PAGE_SIZE = 20
+MAX_NOTIFICATIONS_PAGE = 100
+NO_CURSOR = 2 ** 63 - 1  # "before" value for the first page
+
+
+def unread_count(db, uid):
+    # counted from the (user_id, read, id) index without touching the table
+    return db.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ? AND read = 0', (uid,)).fetchone()[0]
+
+
+def list_notifications(db, uid, before=None, limit=NOTIFICATIONS_PAGE_SIZE, unread_only=False):
+    """
+    One page of notifications, newest first, with ids below `before`.
+    Returns {'items', 'next_before', 'unread'}; next_before is the cursor for
+    the following page (None on the last page).
+    """
+    args = (uid, before if before is not None else NO_CURSOR, limit + 1)
+    if unread_only:
+        rows = db.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? AND read = 0 AND id < ? ORDER BY id DESC LIMIT ?', args).fetchall()
+    else:
+        rows = db.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?', args).fetchall()
+    items = [dict(r) for r in rows[:limit]]
+    next_before = items[-1]['id'] if len(rows) > limit else None
+    return {'items': items, 'next_before': next_before, 'unread': unread_count(db, uid)}
+
+
+# Month payloads are revalidated on every use; the ETag lets the browser
+# (or a proxy) get a bodyless 304 while the month's version is unchanged.
+MONTH_CACHE_CONTROL = 'private, no-cache'
+
+
+def month_etag(db, kind, uid, month_str, version):
+    # the epoch changes on reset/restore, where versions start over
+    return f"{kind}-e{db_epoch(db)}-u{uid}-{month_str}-v{version}"
+
+
+def not_modified(etag):
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = MONTH_CACHE_CONTROL
+    resp.headers['Vary'] = 'Cookie'
+    return resp
+
+
+def with_etag(resp, etag):
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = MONTH_CACHE_CONTROL
+    resp.headers['Vary'] = 'Cookie'
+    return resp
+
+
+def stats_payload(s, habits):
+    return {'overall_percent': s['overall_percent'], 'habit_counts': s['habit_counts'], 'daily_totals': s['daily_totals'], 'weekly': s['weekly'], 'habits': habits}
+
+
+def predict_next_day(uid, habits, comp_map, today):
+    """
+    Per-habit probability of completion tomorrow.
+    comp_map must cover the prediction window (today - 30 days .. today);
+    dates outside it are ignored.
+    """
+    if not habits:
+        return []
+    # one date x habit matrix over the window, features as array ops
+    X = features.next_day_features([h['id'] for h in habits], comp_map, today, PREDICT_WINDOW_DAYS)
+    probs = ml_model.predict_for_user(uid, X)  # your existing model API
+    out = []
+    for i,h in enumerate(habits):
+        p = float(probs[i]) if (probs is not None and i < len(probs)) else None
+        out.append({'habit_id': h['id'], 'name': h['name'], 'probability_next_day': p})
+    return out
 
 
 # ---- Get month data (habits + completions) using snapshots
@@ -290,6 +643,10 @@ def api_month(year, month):
     # Ensure snapshot exists for the month (we intentionally keep it empty if no habits added)
     ensure_snapshot_for_month(uid, year, month)
 
+    etag = month_etag(db, 'month', uid, month_str, month_version(db, uid, month_str))
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
     # Fetch habits for ONLY this month (from snapshots)
     habits = db.execute("""
         SELECT habit_id AS id, name_at_that_time AS name
@@ -298,20 +655,62 @@ def api_month(year, month):
         ORDER BY id
     """, (uid, month_str)).fetchall()
 
-    # Fetch completions for ONLY this month
+    # Fetch completions for ONLY this month (range predicate so the
+    # (user_id, date, habit_id) index is used instead of a scan)
+    dates = get_month_dates(year, month)
     rows = db.execute("""
         SELECT habit_id, date
         FROM completions
-        WHERE user_id = ? AND substr(date,1,7) = ?
-    """, (uid, month_str)).fetchall()
+        WHERE user_id = ? AND date BETWEEN ? AND ?
+    """, (uid, dates[0], dates[-1])).fetchall()
 
     completions = {}
     for r in rows:
         completions.setdefault(r["date"], []).append(r["habit_id"])
 
-    return jsonify({
+    return with_etag(jsonify({
         "habits": [dict(h) for h in habits],
         "completions": completions
+    }), etag)
+
+
+# ---- Everything the dashboard needs for a month, in one round trip
+@app.route("/api/month/<int:year>/<int:month>/bundle")
+def api_month_bundle(year, month):
+    """
+    Combined /api/month + /api/stats + /api/notifications + /api/predict/nextday.
+    Completions for the month and for the 30-day prediction window are read
+    once and the same in-memory map feeds stats and the predictor. Read-only:
+    notifications are generated when completions change.
+    """
+    if not session.get('user_id'):
+        return jsonify({"error": "unauthenticated"}), 401
+
+    uid = session["user_id"]
+    db = get_db()
+    month_str = month_str_from_year_month(year, month)
+    ensure_snapshot_for_month(uid, year, month)
+
+    habits = load_month_habits(db, uid, month_str)
+    dates = get_month_dates(year, month)
+    today = date.today()
+    pred_start, pred_end = prediction_window(today)
+    comp_map = load_completion_map(db, uid, [(dates[0], dates[-1]), (pred_start, pred_end)])
+    month_map = {d: comp_map[d] for d in dates if d in comp_map}
+
+    s = stats.compute_stats(habits, month_map, dates)
+
+    # predictions always use the current month's habits
+    today_month = today.strftime('%Y-%m')
+    pred_habits = habits if today_month == month_str else load_month_habits(db, uid, today_month)
+    pred_map = {d: v for d, v in comp_map.items() if pred_start <= d <= pred_end}
+
+    return jsonify({
+        'habits': habits,
+        'completions': {d: sorted(month_map[d]) for d in sorted(month_map)},
+        'stats': stats_payload(s, habits),
+        'notifications': list_notifications(db, uid),
+        'predictions': predict_next_day(uid, pred_habits, pred_map, today),
     })
 
 
@@ -327,34 +726,136 @@ def api_stats(year, month):
     ensure_snapshot_for_month(uid, year, month)
     mstr = month_str_from_year_month(year, month)
 
-    habits = [dict(r) for r in db.execute('SELECT habit_id as id, name_at_that_time as name FROM habit_snapshots WHERE user_id = ? AND month = ? ORDER BY habit_id', (uid, mstr)).fetchall()]
+    etag = month_etag(db, 'stats', uid, mstr, month_version(db, uid, mstr))
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    habits = load_month_habits(db, uid, mstr)
     dates = get_month_dates(year, month)
-    rows = db.execute('SELECT habit_id, date FROM completions WHERE user_id = ? AND date BETWEEN ? AND ?', (uid, dates[0], dates[-1])).fetchall()
-    comp_map = {}
-    for r in rows:
-        comp_map.setdefault(r['date'], set()).add(r['habit_id'])
-    s = stats.compute_stats(habits, comp_map, dates)
-
-    # generate rule notifications and persist (avoid duplicates)
-    notes = rules.generate_notifications(db, uid, habits, comp_map)
-    for n in notes:
-        exists = db.execute('SELECT 1 FROM notifications WHERE user_id = ? AND message = ?', (uid, n['message'])).fetchone()
-        if not exists:
-            db.execute('INSERT INTO notifications (user_id, message, created_at) VALUES (?,?,?)', (uid, n['message'], datetime.utcnow().isoformat()))
-    db.commit()
+    # counts come from the materialized rollups (kept in sync by the toggle endpoint)
+    counts, day_totals = rollups.month_counts(db, uid, mstr, dates[0], dates[-1])
+    s = stats.compute_stats_from_counts(habits, counts, day_totals, dates)
+    # rule notifications are generated after writes (schedule_rules)
+
+    return with_etag(jsonify(stats_payload(s, habits)), etag)
+
+
+# Longest range /api/stats/range accepts (two years, leap day included)
+MAX_RANGE_DAYS = 731
+
+
+def load_range(db, uid, first, last):
+    """
+    (habits, month_sizes, completions) for first..last (YYYY-MM-DD):
+    snapshot habits of every month in the range (latest name wins), the
+    number of habits per month, and the (habit_id, date) completion rows.
+    """
+    names = {}
+    month_sizes = {}
+    for r in db.execute(
+            'SELECT habit_id, name_at_that_time, month FROM habit_snapshots WHERE user_id = ? AND month BETWEEN ? AND ? ORDER BY month',
+            (uid, first[:7], last[:7])).fetchall():
+        names[r['habit_id']] = r['name_at_that_time']
+        month_sizes[r['month']] = month_sizes.get(r['month'], 0) + 1
+    habits = [{'id': hid, 'name': names[hid]} for hid in sorted(names)]
+    completions = db.execute('SELECT habit_id, date FROM completions WHERE user_id = ? AND date BETWEEN ? AND ?',
+                             (uid, first, last)).fetchall()
+    return habits, month_sizes, completions
+
+
+@app.route('/api/stats/range', methods=['GET'])
+def api_stats_range():
+    """
+    Stats over any date range (e.g. a year for a heatmap) in one request:
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD. Returns per-habit counts, daily totals
+    and ISO-week / month rollups.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    uid = session['user_id']
+    try:
+        first = datetime.strptime(request.args.get('from', ''), '%Y-%m-%d').date()
+        last = datetime.strptime(request.args.get('to', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'from and to (YYYY-MM-DD) required'}), 400
+    if last < first:
+        return jsonify({'error': 'to must not be before from'}), 400
+    if (last - first).days + 1 > MAX_RANGE_DAYS:
+        return jsonify({'error': f'at most {MAX_RANGE_DAYS} days per request'}), 400
+    first, last = first.isoformat(), last.isoformat()
+    db = get_db()
+
+    # every write bumps one month's version, so the sum over the range's
+    # months changes whenever anything in the range does
+    version = db.execute('SELECT COALESCE(SUM(version), 0) FROM month_versions WHERE user_id = ? AND month BETWEEN ? AND ?',
+                         (uid, first[:7], last[:7])).fetchone()[0]
+    etag = month_etag(db, 'range', uid, f'{first}-{last}', version)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
 
-    return jsonify({'overall_percent': s['overall_percent'], 'habit_counts': s['habit_counts'], 'daily_totals': s['daily_totals'], 'weekly': s['weekly'], 'habits': habits})
+    habits, month_sizes, completions = load_range(db, uid, first, last)
+    return with_etag(jsonify(stats.compute_range_stats(habits, month_sizes, completions, first, last)), etag)
 
 
 # ---- Notifications endpoints ----
 @app.route('/api/notifications', methods=['GET'])
 def api_notifications():
+    """
+    Keyset-paginated notifications, newest first.
+    Query: before=<id> (from the previous page's next_before), limit=<n>,
+    unread_only=1. Any of these returns a page {items, next_before, unread};
+    without them the response is the full array, as before pagination.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    uid = session['user_id']
+    if not any(k in request.args for k in ('before', 'limit', 'unread_only')):
+        db = get_db()
+        rows = db.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? ORDER BY id DESC', (uid,)).fetchall()
+        return jsonify([dict(r) for r in rows])
+    try:
+        before = request.args.get('before')
+        before = int(before) if before is not None else None
+        limit = int(request.args.get('limit', NOTIFICATIONS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'before and limit must be integers'}), 400
+    limit = max(1, min(limit, MAX_NOTIFICATIONS_PAGE))
+    unread_only = request.args.get('unread_only', '0').lower() in ('1', 'true', 'yes')
+    db = get_db()
+    return jsonify(list_notifications(db, uid, before, limit, unread_only))
+
+
+@app.route('/api/notifications/unread_count', methods=['GET'])
+def api_unread_count():
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    db = get_db()
+    return jsonify({'unread': unread_count(db, session['user_id'])})
+
+
+@app.route('/api/notifications/read', methods=['POST'])
+def api_mark_read_bulk():
+    """
+    Mark many notifications read in one statement. Body:
+      {"ids": [3, 5, 8]}   or   {"all": true}
+    """
     if not session.get('user_id'):
         return jsonify({'error': 'unauthenticated'}), 401
     uid = session['user_id']
+    data = request.get_json(silent=True) or {}
     db = get_db()
-    rows = db.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? ORDER BY id DESC', (uid,)).fetchall()
-    return jsonify([dict(r) for r in rows])
+    if data.get('all') is True:
+        cur = db.execute('UPDATE notifications SET read = 1 WHERE user_id = ? AND read = 0', (uid,))
+    else:
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            return jsonify({'error': 'ids list of integers or all=true required'}), 400
+        if len(ids) > MAX_BATCH_OPS:
+            return jsonify({'error': f'at most {MAX_BATCH_OPS} ids per request'}), 413
+        marks = ','.join('?' * len(ids))
+        cur = db.execute(f'UPDATE notifications SET read = 1 WHERE user_id = ? AND read = 0 AND id IN ({marks})', [uid] + ids)
+    db.commit()
+    return jsonify({'updated': cur.rowcount, 'unread': unread_count(db, uid)})
 
 
 @app.route('/api/notifications/<int:nid>/read', methods=['POST'])
@@ -378,10 +879,7 @@ def api_predict_nextday():
 
     # Use the CURRENT MONTH snapshot habits (only habits added for this month)
     today = date.today()
-    month_str = today.strftime('%Y-%m')
-    habits = [dict(r) for r in db.execute(
-        'SELECT habit_id as id, name_at_that_time as name FROM habit_snapshots WHERE user_id = ? AND month = ? ORDER BY habit_id',
-        (uid, month_str)).fetchall()]
+    habits = load_month_habits(db, uid, today.strftime('%Y-%m'))
 
     # Optional fallback: if there are no snapshot habits for this month, you may
     # want to predict on the global habit list. Uncomment below if desired.
@@ -389,69 +887,146 @@ def api_predict_nextday():
     #     habits = [dict(r) for r in db.execute('SELECT id,name FROM habits WHERE user_id = ? ORDER BY id', (uid,)).fetchall()]
 
     # Build recent stats from last 30 days
-    end = date.today()
-    start = end - timedelta(days=30)
-    rows = db.execute('SELECT habit_id, date FROM completions WHERE user_id = ? AND date BETWEEN ? AND ?', (uid, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))).fetchall()
-    comp_map = {}
-    for r in rows:
-        comp_map.setdefault(r['date'], set()).add(r['habit_id'])
-
-    # Build features and call ml_model (same as before)
-    feats = []
-    for h in habits:
-        hid = h['id']
-        # recent7
-        recent7 = 0
-        for i in range(1,8):
-            d = (end - timedelta(days=i-1)).strftime('%Y-%m-%d')
-            if hid in comp_map.get(d, set()):
-                recent7 += 1
-        recent7 = recent7 / 7.0
-        # dow tomorrow
-        dow = (end + timedelta(days=1)).weekday()
-        # streak length
-        streak = 0
-        k = 0
-        while True:
-            d = (end - timedelta(days=k)).strftime('%Y-%m-%d')
-            if hid in comp_map.get(d, set()):
-                streak += 1
-                k += 1
-            else:
-                break
-        feats.append({'habit_id': hid, 'recent7': recent7, 'dow': dow, 'streak': streak})
-
-    import pandas as pd
-    df = pd.DataFrame(feats)
-    df = pd.get_dummies(df, columns=['dow'], prefix='dow')
-    for i in range(7):
-        col = f'dow_{i}'
-        if col not in df.columns:
-            df[col] = 0
-    cols = ['recent7','streak'] + [f'dow_{i}' for i in range(7)]
-    if df.shape[0] == 0:
-        # No habits to predict for this month — return empty list
-        return jsonify([])
-
-    X = df[cols]
-    probs = ml_model.predict_for_user(uid, X)  # your existing model API
-    out = []
-    for i,h in enumerate(habits):
-        p = float(probs[i]) if (probs is not None and i < len(probs)) else None
-        out.append({'habit_id': h['id'], 'name': h['name'], 'probability_next_day': p})
-    return jsonify(out)
+    comp_map = load_completion_map(db, uid, [prediction_window(today)])
+    return jsonify(predict_next_day(uid, habits, comp_map, today))
 
-if __name__ == '__main__':
-    # if DB missing, create via migrations (get_db will call migration routine)
-    if not os.path.exists('habit_tracker.db'):
-        with app.app_context():
-            get_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+
+# ---- Export of a user's full history
+EXPORT_CHUNK_ROWS = 1000
+# one flat CSV for all record types; unused columns are left empty
+EXPORT_CSV_COLUMNS = ['type', 'habit_id', 'name', 'created_at', 'month', 'date']
+
+
+def keyset_pages(sql, uid, after, key):
+    """
+    Yield pages of up to EXPORT_CHUNK_ROWS rows of `sql` (params: uid,
+    *after, limit), continuing after key(last row) of the previous page.
+    Each page is read on a pooled connection that is released before the
+    page is yielded.
+    """
+    while True:
+        with get_pool().connection() as con:
+            rows = con.execute(sql, (uid, *after, EXPORT_CHUNK_ROWS)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = key(rows[-1])
+
+
+def export_records(uid):
+    """
+    Yield lists of export records (dicts with a 'type' key): the user's
+    habits, habit snapshots and completions, EXPORT_CHUNK_ROWS at a time.
+    Chunks are keyset-paged, so a slow client never holds a pooled
+    connection or a read transaction between chunks. They are not one
+    snapshot: a change made during the download may or may not appear, but
+    no row is repeated or skipped.
+    """
+    for rows in keyset_pages('SELECT id, name, created_at FROM habits WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+                             uid, (0,), lambda r: (r[0],)):
+        yield [{'type': 'habit', 'habit_id': r[0], 'name': r[1], 'created_at': r[2]} for r in rows]
+    for rows in keyset_pages('SELECT habit_id, name_at_that_time, month, id FROM habit_snapshots '
+                             'WHERE user_id = ? AND (month, id) > (?, ?) ORDER BY month, id LIMIT ?',
+                             uid, ('', 0), lambda r: (r[2], r[3])):
+        yield [{'type': 'snapshot', 'habit_id': r[0], 'name': r[1], 'month': r[2]} for r in rows]
+    for rows in keyset_pages('SELECT habit_id, date FROM completions '
+                             'WHERE user_id = ? AND (date, habit_id) > (?, ?) ORDER BY date, habit_id LIMIT ?',
+                             uid, ('', 0), lambda r: (r[1], r[0])):
+        yield [{'type': 'completion', 'habit_id': r[0], 'date': r[1]} for r in rows]
+
+
+def format_ndjson(chunk):
+    return ''.join(json.dumps(rec, separators=(',', ':')) + '\n' for rec in chunk)
+
+
+def format_csv(chunk):
+    buf = io.StringIO()
+    csv.DictWriter(buf, EXPORT_CSV_COLUMNS, lineterminator='\n').writerows(chunk)
+    return buf.getvalue()
+
+
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    """
+    Stream the user's habits, snapshots and completions as NDJSON (default)
+    or CSV: ?format=ndjson|csv. The body is generated chunk by chunk
+    (chunked transfer encoding), so bytes start flowing immediately and
+    memory does not grow with the history.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    uid = session['user_id']
+
+    def generate():
+        # no connection is held between chunks (see export_records)
+        if fmt == 'csv':
+            yield ','.join(EXPORT_CSV_COLUMNS) + '\n'
+        else:
+            yield format_ndjson([{'type': 'export', 'version': 1, 'exported_at': datetime.utcnow().isoformat()}])
+        for chunk in export_records(uid):
+            yield format_csv(chunk) if fmt == 'csv' else format_ndjson(chunk)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    resp = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename=habits-{date.today().isoformat()}.{fmt}'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+# Largest accepted import body (bytes)
+MAX_IMPORT_BYTES = int(os.environ.get('HABIT_MAX_IMPORT_BYTES', str(64 * 1024 * 1024)))
+
+
+@app.route('/api/import', methods=['POST'])
+def api_import():
+    """
+    Import history from CSV or NDJSON (see importer.py for the format; an
+    /api/export file works as is). Send the file as the raw body or as the
+    multipart field "file"; ?format=csv|ndjson, otherwise taken from the
+    content type / file name. The whole input is parsed and validated before
+    the write lock is taken, then written in one transaction, so it is
+    imported completely or not at all. One retrain and one rules evaluation
+    are scheduled for the whole import.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'unauthenticated'}), 401
+    if request.content_length is None or request.content_length > MAX_IMPORT_BYTES:
+        return jsonify({'error': f'body must have a Content-Length of at most {MAX_IMPORT_BYTES} bytes'}), 413
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        hint = upload.filename if upload is not None else request.mimetype
+        fmt = 'csv' if hint and hint.endswith('csv') else 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    uid = session['user_id']
+    stream = importer.text_stream(upload.stream if upload is not None else request.stream)
+    try:
+        # parse before taking a pooled connection, so a slow upload holds neither
+        # a connection nor the write lock
+        plan = importer.parse_records(importer.read_records(stream, fmt))
+        summary = importer.load_records(get_db(), uid, plan)
+    except importer.ImportFailed as e:
+        return jsonify({'error': 'invalid records, nothing was imported',
+                        'errors': [{'line': line, 'error': msg} for line, msg in e.errors]}), 400
+    except UnicodeDecodeError:
+        return jsonify({'error': 'file must be UTF-8 text'}), 400
+    if summary['completions_inserted']:
+        retrain_scheduler.submit(uid, summary['completions_inserted'])
+        schedule_rules(uid)
+    return jsonify(summary)
 
 # ---------------------------
 # Development admin endpoints
 # ---------------------------
 import shutil
+import tempfile
+
+import backup
+import database
 from flask import send_file
 
 # WARNING: These endpoints are for DEV use only. Remove or protect before deploying.
@@ -465,22 +1040,16 @@ def admin_reset_db():
     if token != os.environ.get('HABIT_ADMIN_TOKEN', 'dev-token'):
         return jsonify({'error':'unauthorized'}), 403
 
-    # backup current DB and recreate
-    project = os.path.dirname(__file__)
-    db_path = os.path.join(project, 'habit_tracker.db')
-    backups_dir = os.path.join(project, 'backups')
-    if not os.path.exists(backups_dir):
-        os.makedirs(backups_dir)
-
-    if os.path.exists(db_path):
-        ts = int(os.path.getmtime(db_path))
-        dst = os.path.join(backups_dir, f"habit_tracker.db.bak.{ts}")
-        shutil.copy2(db_path, dst)
+    # backup current DB (online, through the SQLite backup API) and recreate
+    dst = None
+    if os.path.exists(database.DB_PATH):
+        dst = backup.create_backup()
+    close_pool()
 
     # run init_db logic by importing or reading schema
     from init_db import create_db_from_schema
-    create_db_from_schema()
-    return jsonify({'reset': True})
+    create_db_from_schema(database.DB_PATH)
+    return jsonify({'reset': True, 'backup': os.path.basename(dst) if dst else None})
 
 @app.route('/admin/download-db', methods=['GET'])
 def admin_download_db():
@@ -488,8 +1057,87 @@ def admin_download_db():
     token = request.args.get('token')
     if token != os.environ.get('HABIT_ADMIN_TOKEN', 'dev-token'):
         return jsonify({'error':'unauthorized'}), 403
-    project = os.path.dirname(__file__)
-    db_path = os.path.join(project, 'habit_tracker.db')
-    if not os.path.exists(db_path):
+    if not os.path.exists(database.DB_PATH):
         return jsonify({'error':'db_missing'}), 404
-    return send_file(db_path, as_attachment=True, download_name='habit_tracker.db')
+    # send a consistent snapshot (the live file can change mid-download)
+    tmp = tempfile.mkdtemp(prefix='habit-download-')
+    try:
+        path = backup.create_backup(dest_dir=tmp, keep=0)
+        resp = send_file(path, as_attachment=True, download_name='habit_tracker.db', mimetype='application/vnd.sqlite3')
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    # delete the copy after the response has closed its file (an open file
+    # can't be removed on Windows); close callbacks only run for responses
+    # that are not passed through to the server's file wrapper
+    resp.direct_passthrough = False
+    resp.call_on_close(lambda: shutil.rmtree(tmp, ignore_errors=True))
+    return resp
+
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    """Runtime stats: DB pool, model cache, retrain and rules schedulers."""
+    token = request.headers.get('X-ADMIN-TOKEN') or request.args.get('token')
+    if token != os.environ.get('HABIT_ADMIN_TOKEN', 'dev-token'):
+        return jsonify({'error':'unauthorized'}), 403
+    db = get_db()
+    # plan-check: allow (admin only; an index on since_train would cost every toggle)
+    due = db.execute('SELECT COUNT(*) FROM retrain_counters WHERE since_train >= ?', (RETRAIN_THRESHOLD,)).fetchone()[0]
+    # plan-check: allow
+    top = db.execute('SELECT user_id, since_train, last_trained_at FROM retrain_counters ORDER BY since_train DESC LIMIT 20').fetchall()
+    return jsonify({
+        'db_pool': pool_stats(),
+        'model_cache': ml_model.model_cache_stats(),
+        'retrain_scheduler': retrain_scheduler.stats(),
+        'rules_scheduler': rules_scheduler.stats(),
+        'retrain_counters': {
+            'threshold': RETRAIN_THRESHOLD,
+            'users_due': due,
+            'top': [dict(r) for r in top],
+        },
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus text exposition of the metrics registered in metrics.py.
+    Needs the admin token (X-ADMIN-TOKEN header or ?token=) unless
+    HABIT_METRICS_PUBLIC=1.
+    """
+    if os.environ.get('HABIT_METRICS_PUBLIC', '0') != '1':
+        token = request.headers.get('X-ADMIN-TOKEN') or request.args.get('token')
+        if token != os.environ.get('HABIT_ADMIN_TOKEN', 'dev-token'):
+            return jsonify({'error':'unauthorized'}), 403
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics.register_collector
+def runtime_metrics():
+    for sched, what in ((retrain_scheduler, 'a retrain'), (rules_scheduler, 'a rules run')):
+        s, prefix = sched.stats(), f'habit_{sched.name}'
+        yield f'{prefix}_queue_depth', 'gauge', f'Users waiting for {what}.', [({}, s['queued'])]
+        yield f'{prefix}_running', 'gauge', f'{sched.name.capitalize()} jobs in progress.', [({}, s['running'])]
+        yield (f'{prefix}_jobs_total', 'counter', f'{sched.name.capitalize()} scheduler events by outcome.',
+               [({'outcome': k}, s[k]) for k in ('submitted', 'coalesced', 'rejected', 'completed', 'failed')])
+    p = pool_stats()
+    if p:
+        yield ('habit_db_pool_connections', 'gauge', 'Pooled DB connections by state.',
+               [({'state': 'in_use'}, p['in_use']), ({'state': 'idle'}, p['idle'])])
+        yield 'habit_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection.', [({}, p['wait_seconds_total'])]
+        yield 'habit_db_pool_timeouts_total', 'counter', 'Pool acquires that timed out.', [({}, p['timeouts'])]
+    c = ml_model.model_cache_stats()
+    yield 'habit_model_cache_size', 'gauge', 'Models held in the prediction cache.', [({}, c['size'])]
+    yield ('habit_model_cache_events_total', 'counter', 'Prediction model cache events.',
+           [({'event': k}, c[k]) for k in ('hits', 'misses', 'reloads', 'evictions')])
+
+
+# Run last so the admin routes above are registered before the server starts
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # if DB missing, create via migrations (get_db will call migration routine)
+    if not os.path.exists('habit_tracker.db'):
+        with app.app_context():
+            get_db()
+    app.run(debug=True, host='0.0.0.0', port=5000)
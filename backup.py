@@ -0,0 +1,229 @@
+# backup.py
+"""
+Online database backups.
+
+Copies are made with the SQLite backup API (sqlite3.Connection.backup) a few
+pages at a time with a short sleep between steps, from one read snapshot
+held for the whole copy. In WAL mode (the app's default) that read does not
+block writers, so request handlers keep writing while a backup runs and the
+copy is still consistent. A backup is written to a temporary name and
+renamed when complete, optionally gzipped, and old backups beyond the
+retention count are deleted.
+
+Backups are named habit_tracker-YYYYmmdd-HHMMSS.db[.gz] in backups/; only
+files with that pattern are rotated.
+
+CLI:
+  python backup.py create [--gzip] [--keep N]
+  python backup.py list
+  python backup.py verify FILE      PRAGMA integrity_check on a backup
+  python backup.py restore FILE     verify, then copy over the live database
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import database
+
+# the live database is database.DB_PATH, the same file the app's pool opens
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKUP_DIR = os.path.join(PROJECT_DIR, 'backups')
+
+PAGES_PER_STEP = int(os.environ.get('HABIT_BACKUP_PAGES', '256'))  # 1 MB per step with 4 KB pages
+STEP_SLEEP = float(os.environ.get('HABIT_BACKUP_SLEEP', '0.005'))  # seconds between steps
+KEEP = int(os.environ.get('HABIT_BACKUP_KEEP', '10'))
+
+NAME_RE = re.compile(r'^habit_tracker-(\d{8}-\d{6})(?:-(\d+))?\.db(?:\.gz)?$')
+
+
+class BackupError(Exception):
+    """A backup is missing or failed verification."""
+
+
+def _copy(src, dst, pages=None, sleep=None, progress=None):
+    """Backup API copy in steps of `pages`, sleeping between steps so writers get in."""
+    pause = STEP_SLEEP if sleep is None else sleep
+
+    def step(status, remaining, total):
+        if progress:
+            progress(remaining, total)
+        if remaining and pause:
+            time.sleep(pause)
+
+    # backup()'s own `sleep` only applies when a step finds the source busy
+    src.backup(dst, pages=PAGES_PER_STEP if pages is None else pages, progress=step)
+
+
+def _new_name(dest_dir, compress):
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    ext = '.db.gz' if compress else '.db'
+    name, n = f'habit_tracker-{stamp}{ext}', 1
+    while os.path.exists(os.path.join(dest_dir, name)):
+        n += 1
+        name = f'habit_tracker-{stamp}-{n}{ext}'
+    return os.path.join(dest_dir, name)
+
+
+def create_backup(db_path=None, dest_dir=None, compress=False, keep=None, pages=None, sleep=None, progress=None):
+    """
+    Back up db_path into dest_dir and apply the retention policy.
+    progress(remaining, total) is called after each step.
+    Returns the path of the new backup.
+    """
+    db_path = db_path or database.DB_PATH
+    dest_dir = dest_dir or BACKUP_DIR
+    if not os.path.exists(db_path):
+        raise BackupError(f'{db_path} does not exist')
+    os.makedirs(dest_dir, exist_ok=True)
+    final = _new_name(dest_dir, compress)
+    fd, partial = tempfile.mkstemp(prefix='.habit_tracker-', suffix='.partial', dir=dest_dir)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path, isolation_level=None)
+        dst = sqlite3.connect(partial)
+        try:
+            # Pin one read snapshot for the whole copy. Without it every commit
+            # from the app restarts the copy, which never finishes under
+            # steady writes; in WAL mode the open read does not block writers.
+            src.execute('BEGIN')
+            src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            _copy(src, dst, pages, sleep, progress)
+            src.execute('COMMIT')
+            # the copy inherits WAL mode; make it a self-contained single file
+            dst.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            dst.close()
+            src.close()
+        if compress:
+            with open(partial, 'rb') as f_in, gzip.open(partial + '.gz', 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            os.remove(partial)
+            partial += '.gz'
+        os.replace(partial, final)
+    except BaseException:
+        for path in (partial, partial + '.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    rotate(dest_dir, KEEP if keep is None else keep)
+    return final
+
+
+def list_backups(dest_dir=None):
+    """Backup paths in dest_dir, oldest first."""
+    dest_dir = dest_dir or BACKUP_DIR
+    if not os.path.isdir(dest_dir):
+        return []
+    found = []
+    for name in os.listdir(dest_dir):
+        m = NAME_RE.match(name)
+        if m:
+            found.append(((m.group(1), int(m.group(2) or 1)), os.path.join(dest_dir, name)))
+    return [path for _, path in sorted(found)]
+
+
+def rotate(dest_dir=None, keep=KEEP):
+    """Delete all but the newest `keep` backups. Returns the deleted paths."""
+    old = list_backups(dest_dir)[:-keep] if keep > 0 else []
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def _open_copy(path):
+    """(sqlite3 connection, temp path or None) for a plain or gzipped backup."""
+    if not os.path.exists(path):
+        raise BackupError(f'{path} does not exist')
+    if not path.endswith('.gz'):
+        return sqlite3.connect(f'file:{path}?mode=ro', uri=True), None
+    fd, tmp = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(fd, 'wb') as f_out, gzip.open(path, 'rb') as f_in:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    return sqlite3.connect(tmp), tmp
+
+
+def verify(path):
+    """Problems reported by PRAGMA integrity_check on a backup ([] = ok)."""
+    try:
+        con, tmp = _open_copy(path)
+    except (OSError, EOFError) as e:  # e.g. truncated gzip
+        return [str(e)]
+    try:
+        rows = [r[0] for r in con.execute('PRAGMA integrity_check').fetchall()]
+    except sqlite3.DatabaseError as e:  # not a database at all
+        rows = [str(e)]
+    finally:
+        con.close()
+        if tmp:
+            os.remove(tmp)
+    return [] if rows == ['ok'] else rows
+
+
+def restore(path, db_path=None, pages=None, sleep=None):
+    """
+    Verify a backup and copy it over db_path with the backup API (through
+    SQLite's locks, so WAL files stay consistent). Raises BackupError if the
+    backup is damaged. Stop the app or close its pool first: connections
+    that are open during the restore keep serving stale cache pages.
+    """
+    problems = verify(path)
+    if problems:
+        raise BackupError(f'{path} failed integrity_check: {problems[0]}')
+    src, tmp = _open_copy(path)
+    dst = sqlite3.connect(db_path or database.DB_PATH)
+    try:
+        _copy(src, dst, pages, sleep)
+        # versions restart at the backup's values; invalidate cached ETags
+        database.reset_epoch(dst)
+    finally:
+        dst.close()
+        src.close()
+        if tmp:
+            os.remove(tmp)
+
+
+def main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(description='Online backups of the habit tracker database.')
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('create', help='back up the live database')
+    p.add_argument('--gzip', action='store_true', help='compress the backup')
+    p.add_argument('--keep', type=int, default=KEEP, help=f'backups to retain, 0 = all (default {KEEP})')
+    sub.add_parser('list', help='list backups, oldest first')
+    p = sub.add_parser('verify', help='run PRAGMA integrity_check on a backup')
+    p.add_argument('file')
+    p = sub.add_parser('restore', help='verify a backup and copy it over the live database')
+    p.add_argument('file')
+    args = ap.parse_args(argv)
+
+    if args.command == 'create':
+        started = time.perf_counter()
+        path = create_backup(compress=args.gzip, keep=args.keep)
+        print(f"Wrote {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB) in {time.perf_counter() - started:.1f}s")
+    elif args.command == 'list':
+        for path in list_backups():
+            print(f"{os.path.basename(path)}  {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+    elif args.command == 'verify':
+        problems = verify(args.file)
+        for line in problems[:20]:
+            print(line)
+        print("ok" if not problems else f"{len(problems)} problems")
+        return 1 if problems else 0
+    else:
+        try:
+            restore(args.file)
+        except BackupError as e:
+            print(e)
+            return 1
+        print(f"Restored {args.file} into {database.DB_PATH}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,25 +1,302 @@
 # database.py
-import sqlite3, os
+import sqlite3, os, threading, time, uuid
+from contextlib import contextmanager
 from flask import g
+from metrics import TimedConnection
 DB_PATH = 'habit_tracker.db'
 SCHEMA = os.path.join('migrations', 'schema.sql')
 
+# Applied once to every new connection. WAL lets readers proceed while a
+# writer commits; synchronous=NORMAL is durable across app crashes in WAL mode
+# (only an OS crash can lose the last commits).
+PRAGMAS = [
+    ('journal_mode', os.environ.get('HABIT_DB_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('HABIT_DB_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', int(os.environ.get('HABIT_DB_BUSY_TIMEOUT_MS', '5000'))),
+    ('mmap_size', int(os.environ.get('HABIT_DB_MMAP_SIZE', str(256 * 1024 * 1024)))),
+    ('cache_size', int(os.environ.get('HABIT_DB_CACHE_SIZE', '-16000'))),  # negative = KiB
+    ('foreign_keys', 'ON'),  # schema.sql declares FKs; enforce them on every connection
+]
+POOL_SIZE = int(os.environ.get('HABIT_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('HABIT_DB_POOL_TIMEOUT', '10'))
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within the pool timeout."""
+
+
+def connect(path=None):
+    """Open a new tuned connection (not pooled)."""
+    con = sqlite3.connect(path or DB_PATH, check_same_thread=False, factory=TimedConnection)
+    con.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        con.execute(f'PRAGMA {name} = {value}')
+    return con
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of tuned sqlite connections shared by request handlers
+    and background work (retraining, CLIs). Connections are created lazily up
+    to `size`; acquire() blocks up to `timeout` seconds when all are in use.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._owned = set()  # connections this pool opened and has not closed
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.peak_in_use = 0
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        con = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    con = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f'no free DB connection after {self.timeout}s')
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self._in_use)
+            self.acquisitions += 1
+            wait = time.monotonic() - started
+            if waited:
+                self.waits += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        if con is None:
+            try:
+                con = connect(self.path)
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._owned.add(con)
+        return con
+
+    def release(self, con):
+        """Return a connection acquired from this pool; others are ignored."""
+        with self._cond:
+            if con not in self._owned:
+                return
+        keep = True
+        try:
+            if con.in_transaction:
+                con.rollback()
+        except sqlite3.Error:
+            keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep and not self._closed:
+                self._idle.append(con)
+            else:
+                self._created -= 1
+                self._owned.discard(con)
+                con.close()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        con = self.acquire()
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def close(self):
+        """Close idle connections; in-use ones are closed when released."""
+        with self._cond:
+            self._closed = True
+            for con in self._idle:
+                con.close()
+                self._owned.discard(con)
+                self._created -= 1
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'peak_in_use': self.peak_in_use,
+                'utilization': self._in_use / self.size if self.size else 0.0,
+                'acquisitions': self.acquisitions,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds,
+                'wait_seconds_max': self.max_wait_seconds,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Process-wide pool for DB_PATH; the schema is migrated when it is created."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid() or _pool._closed or _pool.path != DB_PATH:
+            pool = ConnectionPool(DB_PATH)
+            with pool.connection() as con:
+                # creates the schema for a new DB, upgrades an existing one
+                migrate(con)
+            _pool = pool
+        return _pool
+
+def close_pool():
+    """Close pooled connections (e.g. before the DB file is replaced)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+def pool_stats():
+    return _pool.stats() if _pool is not None else None
+
+# Columns added after the original schema; migrate() adds them to older DBs
+# before schema.sql runs (so indexes on them can be created).
+COLUMN_MIGRATIONS = [
+    ('ml_models', 'last_completion_id', 'INTEGER NOT NULL DEFAULT 0'),
+    ('ml_models', 'train_seconds', 'REAL'),
+    ('notifications', 'dedup_key', 'TEXT'),
+]
+
+def migrate(db):
+    """Bring a DB up to the current schema. Idempotent."""
+    added = set()
+    for table, column, decl in COLUMN_MIGRATIONS:
+        cols = [r[1] for r in db.execute(f'PRAGMA table_info({table})').fetchall()]
+        if cols and column not in cols:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+            added.add((table, column))
+    if ('notifications', 'dedup_key') in added:
+        _backfill_notification_keys(db)
+    existing = {r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    with open(SCHEMA, 'r') as f:
+        db.executescript(f.read())
+    db.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:12],))
+    db.commit()
+    if 'completion_rollups' not in existing and 'completions' in existing:
+        # table just added to an existing DB: backfill it from completions
+        import rollups
+        rollups.rebuild(db)
+
+def _backfill_notification_keys(db):
+    # key the oldest row of each (user, message); later copies keep a NULL
+    # key so the unique index can be built over existing duplicates
+    from ai_engine.rules import notification_key
+    rows = db.execute('SELECT MIN(id), message FROM notifications GROUP BY user_id, message').fetchall()
+    db.executemany('UPDATE notifications SET dedup_key = ? WHERE id = ?',
+                   [(notification_key(message), nid) for nid, message in rows])
+
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        should_init = not os.path.exists(DB_PATH)
-        db = g._database = sqlite3.connect(DB_PATH, check_same_thread=False)
-        db.row_factory = sqlite3.Row
-        if should_init:
-            with open(SCHEMA, 'r') as f:
-                db.executescript(f.read())
-            db.commit()
-    return db
+    entry = getattr(g, '_database', None)
+    if entry is None:
+        # remember the owning pool: close_pool() may replace it mid-request
+        pool = get_pool()
+        entry = g._database = (pool, pool.acquire())
+    return entry[1]
+
+def month_version(db, user_id, month_str):
+    """Current change counter for a user's month (0 if never changed)."""
+    row = db.execute('SELECT version FROM month_versions WHERE user_id = ? AND month = ?', (user_id, month_str)).fetchone()
+    return row[0] if row else 0
+
+def db_epoch(db):
+    """Stamp of this DB's creation / last restore (see db_meta in schema.sql)."""
+    row = db.execute("SELECT value FROM db_meta WHERE key = 'epoch'").fetchone()
+    return row[0] if row else '0'
+
+def reset_epoch(db):
+    """Give the DB a new epoch, e.g. after a backup was restored into it. Commits."""
+    db.execute('CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+    db.execute("""
+        INSERT INTO db_meta (key, value) VALUES ('epoch', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (uuid.uuid4().hex[:12],))
+    db.commit()
+
+def bump_month_version(db, user_id, month_str):
+    """Mark a user's month as changed. Does not commit: call inside the write's transaction."""
+    db.execute("""
+        INSERT INTO month_versions (user_id, month, version) VALUES (?, ?, 1)
+        ON CONFLICT(user_id, month) DO UPDATE SET version = version + 1
+    """, (user_id, month_str))
+
+def bump_retrain_counter(db, user_id, added):
+    """Add to the user's completions-since-last-train counter and return it. Caller commits."""
+    db.execute("""
+        INSERT INTO retrain_counters (user_id, since_train) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET since_train = since_train + excluded.since_train
+    """, (user_id, added))
+    return db.execute('SELECT since_train FROM retrain_counters WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+def claim_retrain(db, user_id, threshold):
+    """
+    Atomically take the user's counter if it reached threshold. Returns the
+    claimed count (0 = don't retrain). If training then fails, hand the count
+    back with release_retrain so the trigger isn't lost. Commits.
+    """
+    row = db.execute('SELECT since_train FROM retrain_counters WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None or row[0] < threshold:
+        return 0
+    # subtract rather than zero: completions added meanwhile stay counted
+    cur = db.execute('UPDATE retrain_counters SET since_train = since_train - ? WHERE user_id = ? AND since_train >= ?',
+                     (row[0], user_id, row[0]))
+    db.commit()
+    return row[0] if cur.rowcount else 0
+
+def release_retrain(db, user_id, claimed):
+    """Give back a count taken by claim_retrain (training failed). Commits."""
+    db.execute('UPDATE retrain_counters SET since_train = since_train + ? WHERE user_id = ?', (claimed, user_id))
+    db.commit()
+
+def mark_trained(db, user_id):
+    """Record a successful retrain. Commits."""
+    db.execute("UPDATE retrain_counters SET last_trained_at = datetime('now') WHERE user_id = ?", (user_id,))
+    db.commit()
+
+def reset_retrain_counter(db, user_id):
+    """Mark the user as freshly trained (e.g. by the batch trainer). Commits."""
+    db.execute("""
+        INSERT INTO retrain_counters (user_id, since_train, last_trained_at) VALUES (?, 0, datetime('now'))
+        ON CONFLICT(user_id) DO UPDATE SET since_train = 0, last_trained_at = excluded.last_trained_at
+    """, (user_id,))
+    db.commit()
 
 def close_db(e=None):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    entry = g.pop('_database', None)
+    if entry is not None:
+        pool, db = entry
+        pool.release(db)
         
 def ensure_snapshot_for_month(user_id, year, month):
     db = get_db()
@@ -0,0 +1,318 @@
+# importer.py
+"""
+Bulk import of habit history (e.g. from another tracker, or an /api/export
+file) for one user.
+
+Input is NDJSON or CSV with the record layout of /api/export:
+  type        habit | snapshot | completion (CSV: defaults to completion)
+  habit_id    id in the source file; completions/snapshots may refer to it
+  name        habit name (also resolves completions that have no habit_id)
+  created_at  habit records only
+  month       snapshot records, YYYY-MM
+  date        completion records, YYYY-MM-DD
+so a plain "name,date" CSV is a valid import too. Each habit record with a
+habit_id is a habit of its own (two habits may share a name); records
+without a habit_id are matched by name. File habits are matched to the
+user's existing habits by name, each existing habit at most once; the rest
+are created.
+
+The import runs in two phases so the database write lock is only held for
+the load, not while a (possibly slow) upload is read:
+- parse_records reads and validates everything without touching the
+  database. Habits are numbered in file order; completions are kept in
+  memory in file order as an array of habit numbers and a list of date
+  strings (each distinct date string is stored once), about 12 bytes a
+  row. Any invalid record aborts the import before anything is written.
+- load_records takes the write lock (BEGIN IMMEDIATE), creates the new
+  habits and inserts completions with executemany in batches. A habit with
+  snapshot records in the file gets exactly those snapshots; a habit with
+  none gets one for each month it has completions in. The month versions
+  are bumped, the user's rollups are rebuilt and the retrain counter is
+  bumped once, so the caller can schedule a single retrain. All of this is
+  one transaction.
+
+CLI:
+  python importer.py --user N history.csv [--format csv] [--no-train]
+"""
+import csv
+import io
+import json
+import sys
+from array import array
+from datetime import date, datetime
+from functools import lru_cache
+
+import rollups
+from database import bump_month_version, bump_retrain_counter
+
+BATCH_ROWS = 10000
+MAX_ERRORS = 20  # validation errors reported before giving up
+
+
+class ImportFailed(Exception):
+    """Invalid input; nothing was written. errors: [(line, message)]"""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid records')
+        self.errors = errors
+
+
+def read_records(stream, fmt):
+    """
+    Yield (line number, dict) from a text stream of NDJSON or CSV. Raises
+    ImportFailed on CSV the csv module can't read (e.g. an oversized field).
+    """
+    if fmt == 'csv':
+        reader = csv.reader(stream)
+        try:
+            header = [h.strip() for h in next(reader, [])]
+            for row in reader:
+                # empty cells count as missing, like absent NDJSON keys
+                yield reader.line_num, {k: v for k, v in zip(header, row) if v}
+        except csv.Error as e:
+            raise ImportFailed([(reader.line_num, f'malformed CSV: {e}')]) from None
+    else:
+        for lineno, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            yield lineno, rec
+
+
+@lru_cache(maxsize=4096)
+def _is_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _valid_date(value):
+    # fromisoformat also accepts other ISO forms (2024-W01-1); require YYYY-MM-DD
+    return isinstance(value, str) and len(value) == 10 and value[4] == value[7] == '-' and _is_date(value)
+
+
+def _valid_month(value):
+    return isinstance(value, str) and len(value) == 7 and _valid_date(value + '-01')
+
+
+def parse_records(records):
+    """
+    Validate records (iterable of (line, dict)) without touching the
+    database. Returns a plan for load_records; raises ImportFailed on
+    invalid input.
+    """
+    habits = []       # habit number -> (name, created_at of its habit record or None = import time)
+    by_name = {}      # name -> first habit number with that name
+    source_ids = {}   # habit_id in the file -> habit number
+    comp_habits = array('I')  # completions: habit number ...
+    comp_dates = []           # ... and date, in file order
+    comp_months = set()  # (habit number, month) with completions
+    snapshots = {}    # (habit number, month) -> name from a snapshot record
+    dates = {}        # one shared string per distinct date
+    read = 0
+    errors = []
+
+    def habit_for(rec):
+        # a habit_id seen earlier wins (snapshot names may differ after a
+        # rename); a habit record with a new habit_id is a new habit even if
+        # the name was seen before; anything else is matched by name
+        src = str(rec['habit_id']) if 'habit_id' in rec else None
+        if src in source_ids:
+            return source_ids[src]
+        name = rec.get('name')
+        if not isinstance(name, str) or not name.strip():
+            return None
+        name = name.strip()
+        is_habit = rec.get('type') == 'habit'
+        n = by_name.get(name)
+        if n is None or (is_habit and src is not None):
+            n = len(habits)
+            habits.append((name, rec.get('created_at') if is_habit else None))
+            by_name.setdefault(name, n)
+        if src is not None:
+            source_ids[src] = n
+        return n
+
+    try:
+        for lineno, rec in records:
+            if not isinstance(rec, dict):
+                errors.append((lineno, 'not a JSON object'))
+            else:
+                kind = rec.get('type', 'completion')
+                if kind == 'completion':
+                    n = habit_for(rec)
+                    d = rec.get('date')
+                    if n is None:
+                        errors.append((lineno, 'completion needs a name or the habit_id of an earlier habit record'))
+                    elif not _valid_date(d):
+                        errors.append((lineno, 'date must be YYYY-MM-DD'))
+                    elif not errors:  # once invalid, only keep validating
+                        comp_habits.append(n)
+                        comp_dates.append(dates.setdefault(d, d))
+                        read += 1
+                        comp_months.add((n, d[:7]))
+                elif kind == 'habit':
+                    if habit_for(rec) is None:
+                        errors.append((lineno, 'habit needs a name'))
+                elif kind == 'snapshot':
+                    n = habit_for(rec)
+                    m = rec.get('month')
+                    if n is None:
+                        errors.append((lineno, 'snapshot needs a name or the habit_id of an earlier habit record'))
+                    elif not _valid_month(m):
+                        errors.append((lineno, 'month must be YYYY-MM'))
+                    else:
+                        snapshots[(n, m)] = rec.get('name')
+                elif kind != 'export':  # header line of /api/export files
+                    errors.append((lineno, f'unknown record type {kind!r}'))
+            if len(errors) >= MAX_ERRORS:
+                break
+    except ImportFailed as e:  # unreadable input ends the parse
+        errors.extend(e.errors)
+    if errors:
+        raise ImportFailed(errors)
+    # snapshot records are a habit's full list of months (a habit need not
+    # be shown in every month it has completions in); habits without any
+    # get one for each month with completions, under their current name
+    snapped = {n for n, _ in snapshots}
+    months = dict(snapshots)
+    for n, m in comp_months:
+        if n not in snapped:
+            months[(n, m)] = None
+    return {'habits': habits, 'completions': (comp_habits, comp_dates), 'months': months,
+            'touched': sorted({m for _, m in comp_months} | {m for _, m in months}), 'completions_read': read}
+
+
+def load_records(db, user_id, plan, batch_rows=BATCH_ROWS):
+    """
+    Write a parse_records plan for user_id in one transaction. Each habit in
+    the plan takes the user's oldest not yet matched habit with the same
+    name, or is created (read under the write lock, so a habit created
+    meanwhile is reused). Returns a summary dict. Commits on success.
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        unmatched = {}  # name -> the user's habit ids with that name, oldest first
+        for hid, name in db.execute('SELECT id, name FROM habits WHERE user_id = ? ORDER BY id', (user_id,)):
+            unmatched.setdefault(name, []).append(hid)
+        now = datetime.utcnow().isoformat()
+        habits_created = 0
+        hids = []  # habit number -> id
+        for name, created in plan['habits']:
+            if unmatched.get(name):
+                hids.append(unmatched[name].pop(0))
+            else:
+                hids.append(db.execute('INSERT INTO habits (user_id, name, created_at) VALUES (?, ?, ?)',
+                                       (user_id, name, created or now)).lastrowid)
+                habits_created += 1
+
+        inserted = 0
+        batch = []
+
+        def flush():
+            nonlocal inserted
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO completions (user_id, habit_id, date) VALUES (?, ?, ?)', batch)
+            inserted += db.total_changes - before
+            batch.clear()
+
+        for n, d in zip(*plan['completions']):
+            batch.append((user_id, hids[n], d))
+            if len(batch) >= batch_rows:
+                flush()
+        if batch:
+            flush()
+
+        # a habit shows up in a month only through its snapshot
+        existing = {(r[0], r[1]) for r in db.execute('SELECT habit_id, month FROM habit_snapshots WHERE user_id = ?', (user_id,))}
+        new_snapshots = sorted((hids[n], m, snap or plan['habits'][n][0])
+                               for (n, m), snap in plan['months'].items() if (hids[n], m) not in existing)
+        db.executemany('INSERT INTO habit_snapshots (user_id, habit_id, name_at_that_time, month) VALUES (?, ?, ?, ?)',
+                       [(user_id, hid, snap, m) for hid, m, snap in new_snapshots])
+        touched = plan['touched']
+        for month_str in touched:
+            bump_month_version(db, user_id, month_str)
+        if inserted:
+            bump_retrain_counter(db, user_id, inserted)
+        # recomputes the user's rollups from completions and commits everything
+        rollups.rebuild(db, user_id)
+    except BaseException:
+        db.rollback()
+        raise
+    read = plan['completions_read']
+    return {
+        'habits_created': habits_created,
+        'snapshots_created': len(new_snapshots),
+        'completions_read': read,
+        'completions_inserted': inserted,
+        'duplicates_skipped': read - inserted,
+        'months': len(touched),
+    }
+
+
+def import_records(db, user_id, records, batch_rows=BATCH_ROWS):
+    """
+    parse_records, then load_records. Raises ImportFailed on invalid input,
+    with nothing written.
+    """
+    return load_records(db, user_id, parse_records(records), batch_rows)
+
+
+def text_stream(binary):
+    """Wrap a binary upload/file stream for read_records (a UTF-8 BOM is skipped)."""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def main(argv):
+    import argparse
+    import time
+    from database import get_pool, reset_retrain_counter
+    ap = argparse.ArgumentParser(description='Import habit history for a user from CSV or NDJSON.')
+    ap.add_argument('file', help='input file, or - for stdin')
+    ap.add_argument('--user', type=int, required=True)
+    ap.add_argument('--format', choices=['csv', 'ndjson'], default=None, help='default: from the file extension')
+    ap.add_argument('--no-train', action='store_true', help='do not retrain the user model afterwards')
+    args = ap.parse_args(argv)
+    fmt = args.format or ('csv' if args.file.endswith('.csv') else 'ndjson')
+
+    started = time.perf_counter()
+    with get_pool().connection() as con:
+        if con.execute('SELECT 1 FROM users WHERE id = ?', (args.user,)).fetchone() is None:
+            print(f"No user {args.user}.")
+            return 1
+        stream = sys.stdin if args.file == '-' else open(args.file, 'r', encoding='utf-8-sig', newline='')
+        try:
+            summary = import_records(con, args.user, read_records(stream, fmt))
+        except ImportFailed as e:
+            for line, msg in e.errors:
+                print(f"line {line}: {msg}")
+            print("Import aborted; nothing was written.")
+            return 1
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - started
+        print(f"Imported {summary['completions_inserted']} completions "
+              f"({summary['duplicates_skipped']} already present), {summary['habits_created']} new habits, "
+              f"{summary['snapshots_created']} snapshots in {elapsed:.1f}s")
+        if summary['completions_inserted']:
+            # the app runs the rules on its scheduler after /api/import
+            from ai_engine import notifier
+            notifier.evaluate_users(con, [args.user], date.today())
+            con.commit()
+        if summary['completions_inserted'] and not args.no_train:
+            from ai_engine.trainer import train_for_user
+            path = train_for_user(args.user, incremental=False)
+            reset_retrain_counter(con, args.user)
+            print("Trained model:", path if path else "not enough data")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
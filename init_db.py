@@ -1,39 +1,44 @@
 # init_db.py
 import os
-import shutil
 import sqlite3
 
+import backup
+import database
+
 PROJECT_DIR = os.path.dirname(__file__)
-DB_PATH = os.path.join(PROJECT_DIR, "habit_tracker.db")
 SCHEMA_PATH = os.path.join(PROJECT_DIR, "migrations", "schema.sql")
-BACKUP_DIR = os.path.join(PROJECT_DIR, "backups")
+
+# the database is database.DB_PATH, the file the app's pool opens and
+# backup.py copies; read at call time so all three always agree
 
 def backup_db():
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
-    if os.path.exists(DB_PATH):
-        name = f"habit_tracker.db.backup.{int(os.path.getmtime(DB_PATH))}"
-        dst = os.path.join(BACKUP_DIR, name)
-        print(f"Backing up existing DB to: {dst}")
-        shutil.copy2(DB_PATH, dst)
-
-def create_db_from_schema():
+    # online copy through the SQLite backup API; rotates old backups (see backup.py)
+    if os.path.exists(database.DB_PATH):
+        dst = backup.create_backup(database.DB_PATH)
+        print(f"Backed up existing DB to: {dst}")
+        return dst
+
+def create_db_from_schema(db_path=None):
+    db_path = db_path or database.DB_PATH
     if not os.path.exists(SCHEMA_PATH):
         raise FileNotFoundError(f"Schema file not found: {SCHEMA_PATH}")
 
-    # remove old DB (we backed it up above)
-    if os.path.exists(DB_PATH):
+    # remove old DB (we backed it up above), including WAL-mode side files
+    if os.path.exists(db_path):
         print("Removing existing DB file (fresh create).")
-        os.remove(DB_PATH)
+        os.remove(db_path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
 
     # create a fresh DB and run schema SQL
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
         sql = f.read()
     conn.executescript(sql)
     conn.commit()
     conn.close()
-    print("Database created from schema at:", DB_PATH)
+    print("Database created from schema at:", db_path)
 
 def main(backup_existing=True):
     if backup_existing:
@@ -0,0 +1,234 @@
+# metrics.py
+"""
+In-process metrics with Prometheus text exposition (served at /metrics).
+
+- Histogram / Counter: labelled, thread-safe, no external dependency
+- TimedConnection: sqlite3 connection factory (see database.connect) that
+  times every execute/executemany/executescript, on the connection and on
+  its cursors (TimedCursor). Queries run while a
+  request is being tracked are also attributed to that request, so the
+  app can report query counts and SQL time per request and log the
+  offending statements of slow requests.
+- register_collector: callables sampled at scrape time (pool stats, retrain
+  queue depth, ...)
+"""
+import contextvars
+import sqlite3
+import threading
+import time
+
+# Prometheus' default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, lv)} {_fmt(v)}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.label_names + ('le',)
+        with self._lock:
+            for lv, s in sorted(self._series.items()):
+                for b, n in zip(self.buckets, s):
+                    lines.append(f'{self.name}_bucket{_labels(names, lv + (_fmt(float(b)),))} {n}')
+                lines.append(f'{self.name}_bucket{_labels(names, lv + ("+Inf",))} {s[-1]}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, lv)} {_fmt(s[-2])}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, lv)} {s[-1]}')
+        return lines
+
+
+_metrics = []
+_collectors = []
+
+
+def counter(name, help, labels=()):
+    m = Counter(name, help, labels)
+    _metrics.append(m)
+    return m
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    m = Histogram(name, help, labels, buckets)
+    _metrics.append(m)
+    return m
+
+
+def register_collector(fn):
+    """
+    fn() -> iterable of (name, type, help, [(labels dict, value)]), sampled
+    at every scrape. Errors in a collector are skipped, not raised.
+    """
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for m in _metrics:
+        lines.extend(m.render())
+    for fn in _collectors:
+        try:
+            samples = list(fn())
+        except Exception:
+            continue
+        for name, kind, help, values in samples:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, v in values:
+                lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {_fmt(v)}')
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- SQL timing ----------
+SQL_SECONDS = histogram('habit_sql_query_seconds', 'Time spent in sqlite execute calls.',
+                        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+
+
+class RequestStats:
+    """SQL activity of one request (or any other tracked unit of work)."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = []  # (seconds, sql), kept for the slow-request log
+
+    def record(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        self.statements.append((seconds, sql))
+
+    def slowest(self, n=5):
+        return sorted(self.statements, key=lambda s: s[0], reverse=True)[:n]
+
+
+_current = contextvars.ContextVar('habit_request_stats', default=None)
+
+
+def start_tracking():
+    """Attribute queries on this thread/context to a new RequestStats until stop_tracking."""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def stop_tracking(token):
+    _current.reset(token)
+
+
+def _record(sql, started):
+    seconds = time.perf_counter() - started
+    SQL_SECONDS.observe(seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(sql, seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor returned by TimedConnection.cursor(); times its execute calls."""
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            _record(sql, started)
+
+    def executescript(self, sql):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql)
+        finally:
+            _record('<script>', started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3.connect(..., factory=TimedConnection). Times the execute call
+    (statement preparation and the first step); rows fetched afterwards
+    are not included. Connection.execute does not go through cursor(), so
+    both are wrapped.
+    """
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            _record(sql, started)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            _record(sql, started)
+
+    def executescript(self, sql):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql)
+        finally:
+            _record('<script>', started)
@@ -43,17 +43,20 @@ CREATE TABLE IF NOT EXISTS notifications (
   message TEXT NOT NULL,
   created_at TEXT NOT NULL,
   read INTEGER DEFAULT 0,
+  dedup_key TEXT,  -- sha1 of message, see ai_engine.rules.notification_key
   FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
 -------------------------------------------------------------------
--- ML MODELS TABLE (stores model path per user)
+-- ML MODELS TABLE (stores model path per user, one row per user)
 -------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS ml_models (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   user_id INTEGER NOT NULL,
   model_path TEXT NOT NULL,
   updated_at TEXT NOT NULL,
+  last_completion_id INTEGER NOT NULL DEFAULT 0,  -- max completions.id seen by the last training run
+  train_seconds REAL,
   FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -74,14 +77,94 @@ CREATE TABLE IF NOT EXISTS habit_snapshots (
     -- note: habit_id intentionally has no FOREIGN KEY so snapshots persist
 );
 
+-------------------------------------------------------------------
+-- COMPLETION ROLLUPS (materialized counts maintained on toggle)
+-- One row per (user, habit, period, bucket); habit_id = 0 holds the
+-- all-habits total. Rebuild with: python rollups.py rebuild
+-------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS completion_rollups (
+  user_id INTEGER NOT NULL,
+  habit_id INTEGER NOT NULL,
+  period TEXT NOT NULL,   -- 'day' | 'week' | 'month'
+  bucket TEXT NOT NULL,   -- "YYYY-MM-DD" | ISO week "YYYY-Www" | "YYYY-MM"
+  count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, period, bucket, habit_id)
+) WITHOUT ROWID;
+
+-------------------------------------------------------------------
+-- MONTH VERSIONS (per-user, per-month change counter used for ETags)
+-- Bumped whenever a month's habits or completions change.
+-------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS month_versions (
+  user_id INTEGER NOT NULL,
+  month TEXT NOT NULL,   -- "YYYY-MM"
+  version INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+-------------------------------------------------------------------
+-- DB META (key/value). 'epoch' is set when the DB is created or a backup
+-- is restored; it is part of every ETag, so versions that start over in a
+-- new or restored DB never match a cached ETag from the old one.
+-------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS db_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+) WITHOUT ROWID;
+
+-------------------------------------------------------------------
+-- RETRAIN COUNTERS (completions added since the user's last retrain)
+-- Incremented in the toggle/batch transaction; the retrain check is a
+-- primary-key lookup instead of a COUNT(*) over the user's history.
+-------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS retrain_counters (
+  user_id INTEGER PRIMARY KEY,
+  since_train INTEGER NOT NULL DEFAULT 0,
+  last_trained_at TEXT,
+  FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-------------------------------------------------------------------
+-- JOB CHECKPOINTS (resume point of offline batch jobs, e.g. the notifier)
+-------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+  job TEXT PRIMARY KEY,
+  run_date TEXT NOT NULL,        -- "YYYY-MM-DD" the run evaluates
+  last_user_id INTEGER NOT NULL DEFAULT 0,
+  finished INTEGER NOT NULL DEFAULT 0,
+  updated_at TEXT NOT NULL
+);
+
 -------------------------------------------------------------------
 -- RECOMMENDED INDEXES (FASTER LOADING)
 -------------------------------------------------------------------
-CREATE INDEX IF NOT EXISTS idx_completions_user_date
-ON completions(user_id, date);
+-- covers the month/range queries (user_id, date range -> habit_id) without
+-- touching the table; replaces the older idx_completions_user_date
+CREATE INDEX IF NOT EXISTS idx_completions_user_date_habit
+ON completions(user_id, date, habit_id);
+
+DROP INDEX IF EXISTS idx_completions_user_date;
+
+CREATE INDEX IF NOT EXISTS idx_notifications_user
+ON notifications(user_id, id);
+
+-- unread filter / unread count / keyset pages over unread rows
+CREATE INDEX IF NOT EXISTS idx_notifications_user_read
+ON notifications(user_id, read, id);
+
+-- one row per distinct message per user (INSERT OR IGNORE dedups against it)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_dedup
+ON notifications(user_id, dedup_key);
+
+-- per-user habit listing (export, import name matching)
+CREATE INDEX IF NOT EXISTS idx_habits_user
+ON habits(user_id, id);
 
 CREATE INDEX IF NOT EXISTS idx_snapshots_user_month
 ON habit_snapshots(user_id, month);
 
 CREATE INDEX IF NOT EXISTS idx_snapshots_habit
 ON habit_snapshots(habit_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ml_models_user
+ON ml_models(user_id);
@@ -0,0 +1,166 @@
+# rollups.py
+"""
+Materialized completion counts (the completion_rollups table).
+
+Every completion counts once in each of its day / week / month buckets,
+both for its own habit_id and for the habit_id = 0 "all habits" total.
+api_toggle_completion applies +1/-1 deltas in the same transaction as the
+insert/delete, so month stats can be read with two indexed lookups instead
+of scanning completions.
+
+CLI:
+  python rollups.py rebuild [--user N]   recompute rollups from completions
+  python rollups.py check [--user N]     report rows that disagree with completions
+"""
+import sys
+from collections import Counter
+from datetime import date
+from functools import lru_cache
+
+TOTAL = 0  # habit_id used for the all-habits rows
+
+
+@lru_cache(maxsize=4096)
+def buckets_for(date_str):
+    """((period, bucket), ...) for a YYYY-MM-DD date."""
+    y, w, _ = date.fromisoformat(date_str).isocalendar()
+    return (('day', date_str), ('week', f'{y}-W{w:02d}'), ('month', date_str[:7]))
+
+
+def _delta_rows(user_id, changes):
+    """changes: iterable of (habit_id, date, delta) -> aggregated upsert rows."""
+    acc = Counter()
+    for hid, d, delta in changes:
+        for period, bucket in buckets_for(d):
+            acc[(hid, period, bucket)] += delta
+            acc[(TOTAL, period, bucket)] += delta
+    return [(user_id, hid, period, bucket, n) for (hid, period, bucket), n in acc.items() if n]
+
+
+def apply_completion_deltas(db, user_id, changes):
+    """
+    Apply completion changes to the rollups. Does not commit: call inside the
+    transaction that inserts/deletes the completions.
+    changes: iterable of (habit_id, date, +1 or -1)
+    """
+    rows = _delta_rows(user_id, changes)
+    if rows:
+        db.executemany("""
+            INSERT INTO completion_rollups (user_id, habit_id, period, bucket, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, period, bucket, habit_id) DO UPDATE SET count = count + excluded.count
+        """, rows)
+
+
+def month_counts(db, user_id, month, first_day, last_day):
+    """
+    Returns (habit_counts, day_totals) for a month:
+      habit_counts: dict habit_id -> completions in the month
+      day_totals: dict date -> completions on that day (all habits)
+    """
+    habit_counts = {}
+    for hid, n in db.execute("""
+        SELECT habit_id, count FROM completion_rollups
+        WHERE user_id = ? AND period = 'month' AND bucket = ? AND habit_id != ?
+    """, (user_id, month, TOTAL)).fetchall():
+        habit_counts[hid] = n
+    day_totals = {}
+    for d, n in db.execute("""
+        SELECT bucket, count FROM completion_rollups
+        WHERE user_id = ? AND period = 'day' AND bucket BETWEEN ? AND ? AND habit_id = ?
+    """, (user_id, first_day, last_day, TOTAL)).fetchall():
+        day_totals[d] = n
+    return habit_counts, day_totals
+
+
+def _expected(db, user_id=None):
+    """Rollup counts recomputed from completions: {(user, habit, period, bucket): n}."""
+    if user_id is None:
+        cur = db.execute('SELECT user_id, habit_id, date FROM completions')
+    else:
+        cur = db.execute('SELECT user_id, habit_id, date FROM completions WHERE user_id = ?', (user_id,))
+    acc = Counter()
+    while True:
+        rows = cur.fetchmany(10000)
+        if not rows:
+            break
+        for uid, hid, d in rows:
+            for period, bucket in buckets_for(d):
+                acc[(uid, hid, period, bucket)] += 1
+                acc[(uid, TOTAL, period, bucket)] += 1
+    return acc
+
+
+def rebuild(db, user_id=None):
+    """Recompute rollups from completions (all users or one). Commits."""
+    # Aggregated inside SQLite (a rebuild after a bulk import covers millions
+    # of rows); only the ISO week of each distinct date is computed in Python.
+    where, params = ('', ()) if user_id is None else ('WHERE c.user_id = ?', (user_id,))
+    if user_id is None:
+        db.execute('DELETE FROM completion_rollups')
+    else:
+        db.execute('DELETE FROM completion_rollups WHERE user_id = ?', (user_id,))
+    db.execute('CREATE TEMP TABLE rollup_weeks (date TEXT PRIMARY KEY, week TEXT NOT NULL) WITHOUT ROWID')
+    dates = db.execute(f'SELECT DISTINCT c.date FROM completions c {where}', params).fetchall()
+    db.executemany('INSERT INTO temp.rollup_weeks (date, week) VALUES (?, ?)', [(r[0], buckets_for(r[0])[1][1]) for r in dates])
+    insert = 'INSERT INTO completion_rollups (user_id, habit_id, period, bucket, count) '
+    n = 0
+    for period, bucket in (('day', 'c.date'), ('week', 'w.week'), ('month', 'substr(c.date, 1, 7)')):
+        n += db.execute(insert + f"""
+            SELECT c.user_id, c.habit_id, '{period}', {bucket}, COUNT(*)
+            FROM completions c JOIN temp.rollup_weeks w ON w.date = c.date {where}
+            GROUP BY c.user_id, c.habit_id, {bucket}
+        """, params).rowcount
+    n += db.execute(insert + f"""
+        SELECT c.user_id, {TOTAL}, 'day', c.date, COUNT(*) FROM completions c {where} GROUP BY c.user_id, c.date
+    """, params).rowcount
+    # week and month totals from the (much smaller) day totals
+    day_totals = f"WHERE r.period = 'day' AND r.habit_id = {TOTAL}" + ('' if user_id is None else ' AND r.user_id = ?')
+    for period, bucket in (('week', 'w.week'), ('month', 'substr(r.bucket, 1, 7)')):
+        n += db.execute(insert + f"""
+            SELECT r.user_id, {TOTAL}, '{period}', {bucket}, SUM(r.count)
+            FROM completion_rollups r JOIN temp.rollup_weeks w ON w.date = r.bucket {day_totals}
+            GROUP BY r.user_id, {bucket}
+        """, params).rowcount
+    db.execute('DROP TABLE temp.rollup_weeks')
+    db.commit()
+    return n
+
+
+def check(db, user_id=None):
+    """List of (key, expected, actual) for rollup rows that disagree with completions."""
+    expected = _expected(db, user_id)
+    if user_id is None:
+        rows = db.execute('SELECT user_id, habit_id, period, bucket, count FROM completion_rollups').fetchall()
+    else:
+        rows = db.execute('SELECT user_id, habit_id, period, bucket, count FROM completion_rollups WHERE user_id = ?', (user_id,)).fetchall()
+    actual = {tuple(r[:4]): r[4] for r in rows}
+    problems = []
+    for key in set(expected) | set(actual):
+        e, a = expected.get(key, 0), actual.get(key, 0)
+        if e != a:
+            problems.append((key, e, a))
+    return sorted(problems)
+
+
+def main(argv):
+    import argparse
+    from database import get_pool
+    ap = argparse.ArgumentParser(description='Maintain the completion_rollups table.')
+    ap.add_argument('command', choices=['rebuild', 'check'])
+    ap.add_argument('--user', type=int, default=None)
+    args = ap.parse_args(argv)
+    with get_pool().connection() as con:
+        if args.command == 'rebuild':
+            n = rebuild(con, args.user)
+            print(f"Rebuilt {n} rollup rows.")
+            return 0
+        problems = check(con, args.user)
+        for (uid, hid, period, bucket), e, a in problems[:50]:
+            print(f"user {uid} habit {hid} {period} {bucket}: expected {e}, found {a}")
+        print(f"{len(problems)} inconsistent rollup rows.")
+        return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,72 @@
+# scripts/bench_startup.py
+"""
+Startup budget for the web app.
+
+Imports app.py in fresh interpreters (as a gunicorn worker would on boot or
+reload) and measures the import time and the peak RSS of the process. Exits
+non-zero if the median import time or the RSS goes over budget, or if the
+import pulled in any of the training-only packages (sklearn, pandas,
+joblib), which must stay lazy.
+
+Usage: python scripts/bench_startup.py [--runs 5] [--max-ms 400] [--max-rss-mb 64]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORBIDDEN = ('sklearn', 'pandas', 'joblib')
+
+# Run in the child: time `import app`, then report RSS and loaded modules.
+CHILD = """
+import json, resource, sys, time
+t = time.perf_counter()
+import app
+ms = (time.perf_counter() - t) * 1000
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+top = sorted({m.split('.')[0] for m in sys.modules})
+print(json.dumps({'ms': ms, 'rss_mb': rss_kb / 1024, 'modules': top}))
+"""
+
+
+def measure():
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('--max-ms', type=float, default=float(os.environ.get('HABIT_STARTUP_MAX_MS', '400')))
+    ap.add_argument('--max-rss-mb', type=float, default=float(os.environ.get('HABIT_STARTUP_MAX_RSS_MB', '64')))
+    args = ap.parse_args()
+
+    measure()  # warm the filesystem / bytecode caches
+    runs = [measure() for _ in range(args.runs)]
+    ms = statistics.median(r['ms'] for r in runs)
+    rss = max(r['rss_mb'] for r in runs)
+    loaded = [m for m in FORBIDDEN if m in runs[0]['modules']]
+
+    print(f"import app: median {ms:.0f} ms over {args.runs} runs (budget {args.max_ms:.0f} ms)")
+    print(f"peak RSS:   {rss:.1f} MB (budget {args.max_rss_mb:.0f} MB)")
+    failures = 0
+    if ms > args.max_ms:
+        print("FAIL: import time over budget")
+        failures += 1
+    if rss > args.max_rss_mb:
+        print("FAIL: RSS over budget")
+        failures += 1
+    if loaded:
+        print(f"FAIL: training-only packages imported at startup: {', '.join(loaded)}")
+        failures += 1
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# scripts/bench_stats_range.py
+"""
+Benchmark for /api/stats/range.
+
+Builds a throwaway database (one user, --habits habits, --days days of
+completions ending yesterday, a snapshot per month), then times the real
+endpoint through the Flask test client. ETags are not sent, so every
+request does the full query + aggregation. Exits non-zero if the median
+exceeds --budget-ms.
+
+Usage: python scripts/bench_stats_range.py [--habits 50] [--days 365] [--budget-ms 50]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+
+
+def populate(con, habits, days, density):
+    con.execute("INSERT INTO users (id, email, password_hash, created_at) VALUES (1, 'bench@example.com', '-', '2020-01-01')")
+    end = date.today() - timedelta(days=1)
+    dates = [(end - timedelta(days=i)).isoformat() for i in range(days - 1, -1, -1)]
+    months = sorted({d[:7] for d in dates})
+    hids = []
+    for k in range(habits):
+        hid = con.execute("INSERT INTO habits (user_id, name, created_at) VALUES (1, ?, '2020-01-01')", (f'habit {k}',)).lastrowid
+        hids.append(hid)
+        con.executemany('INSERT INTO habit_snapshots (user_id, habit_id, name_at_that_time, month) VALUES (1, ?, ?, ?)',
+                        [(hid, f'habit {k}', m) for m in months])
+    rng = random.Random(42)
+    con.executemany('INSERT INTO completions (user_id, habit_id, date) VALUES (1, ?, ?)',
+                    [(hid, d) for d in dates for hid in hids if rng.random() < density])
+    con.commit()
+    return dates[0], dates[-1]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--habits', type=int, default=50)
+    ap.add_argument('--days', type=int, default=365)
+    ap.add_argument('--density', type=float, default=0.6)
+    ap.add_argument('--runs', type=int, default=30)
+    ap.add_argument('--budget-ms', type=float, default=50.0)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(ROOT)  # schema path is relative to the repo root
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        with database.get_pool().connection() as con:
+            first, last = populate(con, args.habits, args.days, args.density)
+            n = con.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+        from app import app
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'] = 1
+        url = f'/api/stats/range?from={first}&to={last}'
+        assert client.get(url).status_code == 200  # warm up
+        times = []
+        for _ in range(args.runs):
+            t = time.perf_counter()
+            resp = client.get(url)
+            times.append((time.perf_counter() - t) * 1000)
+            assert resp.status_code == 200
+        database.close_pool()
+
+    med = statistics.median(times)
+    print(f"{args.habits} habits x {args.days} days ({n} completions): "
+          f"median {med:.1f} ms, max {max(times):.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    if med > args.budget_ms:
+        print("FAIL: over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# scripts/check_backup.py
+"""
+Check that backups are online and restorable.
+
+Builds a throwaway database (--rows completions), then runs backup.py's
+create_backup while a writer thread keeps inserting completions through the
+app's tuned connection. Reports how many commits the writer made during the
+backup and its slowest commit, verifies the backup with integrity_check,
+restores it into a second file and compares row counts. Exits non-zero if
+the backup is damaged, the restore differs, or a writer commit took longer
+than --max-stall-ms.
+
+Usage: python scripts/check_backup.py [--rows 500000] [--gzip] [--max-stall-ms 250]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backup
+import database
+
+
+def populate(con, rows):
+    con.execute("INSERT INTO users (id, email, password_hash, created_at) VALUES (1, 'backup@example.com', '-', '2020-01-01')")
+    habits = 50
+    con.executemany("INSERT INTO habits (id, user_id, name, created_at) VALUES (?, 1, ?, '2020-01-01')",
+                    [(h, f'habit {h}') for h in range(1, habits + 1)])
+    start = date(2000, 1, 1)
+    con.executemany('INSERT INTO completions (user_id, habit_id, date) VALUES (1, ?, ?)',
+                    [(i % habits + 1, (start + timedelta(days=i // habits)).isoformat()) for i in range(rows)])
+    con.commit()
+    return start + timedelta(days=rows // habits + 1)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=500000)
+    ap.add_argument('--gzip', action='store_true')
+    ap.add_argument('--max-stall-ms', type=float, default=250.0)
+    args = ap.parse_args()
+
+    os.chdir(ROOT)  # schema path is relative to the repo root
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'live.db')
+        con = database.connect(path)
+        database.migrate(con)
+        next_day = populate(con, args.rows)
+        con.close()
+
+        stop = threading.Event()
+        commits = []  # commit latencies (seconds) while the backup runs
+
+        def writer():
+            w = database.connect(path)
+            d = next_day
+            while not stop.is_set():
+                t = time.perf_counter()
+                w.execute('INSERT INTO completions (user_id, habit_id, date) VALUES (1, 1, ?)', (d.isoformat(),))
+                w.commit()
+                commits.append(time.perf_counter() - t)
+                d += timedelta(days=1)
+                time.sleep(0.001)
+            w.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        started = time.perf_counter()
+        target = backup.create_backup(path, os.path.join(tmp, 'backups'), compress=args.gzip, keep=2)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        thread.join()
+
+        problems = backup.verify(target)
+        restored = os.path.join(tmp, 'restored.db')
+        backup.restore(target, restored)
+        copy_rows = sqlite3.connect(restored).execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+    stall = max(commits) * 1000 if commits else 0.0
+    print(f"backup of {args.rows} completions: {elapsed:.2f}s, {os.path.basename(target)}")
+    print(f"writer: {len(commits)} commits during the backup, slowest {stall:.1f} ms")
+    print(f"restored copy: {copy_rows} completions (at least {args.rows} expected)")
+    failed = False
+    if problems:
+        print("FAIL: integrity_check:", problems[:5])
+        failed = True
+    if copy_rows < args.rows:
+        print("FAIL: restored copy is missing rows")
+        failed = True
+    if stall > args.max_stall_ms:
+        print(f"FAIL: a writer commit took longer than {args.max_stall_ms:.0f} ms")
+        failed = True
+    if not commits:
+        print("FAIL: the writer made no progress during the backup")
+        failed = True
+    print("FAIL" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# scripts/check_inference_parity.py
+"""
+Parity check for the NumPy inference path.
+
+Fits models with ml_model.train_model_for_user on random feature tables
+(including ones missing some dow_* columns, like models trained on short
+histories) into a temporary model dir, and compares
+ml_model.predict_for_user against the estimator's predict_proba.
+Also checks the on-the-fly export of a pickle that has no coefficient file.
+
+Usage: python scripts/check_inference_parity.py [--cases N] [--tol 1e-9]
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import joblib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_engine import ml_model
+from ai_engine.features import FEATURE_COLUMNS
+
+
+def random_case(rng):
+    """(feature_df, target) on a random subset of the dow columns."""
+    n = int(rng.integers(20, 400))
+    dows = sorted(rng.choice(7, size=int(rng.integers(1, 8)), replace=False))
+    cols = ['recent7', 'streak'] + [f'dow_{i}' for i in dows]
+    df = pd.DataFrame({
+        'recent7': rng.integers(0, 8, n) / 7.0,
+        'streak': rng.integers(0, 60, n),
+    })
+    dow = rng.choice(dows, n)
+    for i in dows:
+        df[f'dow_{i}'] = (dow == i).astype(int)
+    df = df[cols]
+    logit = 3 * df['recent7'] + 0.05 * df['streak'] - 2 + rng.normal(0, 1, n)
+    y = (logit > 0).astype(int)
+    if y.nunique() < 2:
+        y.iloc[0] = 1 - y.iloc[0]
+    return df, y
+
+
+def query_matrix(rng, n):
+    X = np.zeros((n, len(FEATURE_COLUMNS)))
+    X[:, 0] = rng.integers(0, 8, n) / 7.0
+    X[:, 1] = rng.integers(0, 200, n)
+    X[np.arange(n), 2 + rng.integers(0, 7, n)] = 1.0
+    return X
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--cases', type=int, default=50)
+    ap.add_argument('--tol', type=float, default=1e-9)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    worst = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        ml_model.MODEL_DIR = tmp
+        for uid in range(1, args.cases + 1):
+            df, y = random_case(rng)
+            ml_model.train_model_for_user(uid, df, y)
+            est = joblib.load(ml_model.model_path_for(uid))
+            if uid % 5 == 0:
+                # pickle from before coefficients were exported
+                os.remove(ml_model.coef_path_for(uid))
+            X = query_matrix(rng, 64)
+            # the estimator was fitted on scaled input; the NumPy path takes raw features
+            expected = est.predict_proba(ml_model.scale_features(pd.DataFrame(X, columns=FEATURE_COLUMNS)[list(df.columns)]))[:, 1]
+            got = ml_model.predict_for_user(uid, X)
+            got_df = ml_model.predict_for_user(uid, pd.DataFrame(X, columns=FEATURE_COLUMNS))
+            worst = max(worst, float(np.abs(got - expected).max()), float(np.abs(got_df - expected).max()))
+    print(f"{args.cases} models, max |numpy - predict_proba| = {worst:.3g}")
+    if worst > args.tol:
+        print(f"FAIL: exceeds tolerance {args.tol}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
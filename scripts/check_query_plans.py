@@ -0,0 +1,106 @@
+# scripts/check_query_plans.py
+"""
+Query plan regression check.
+
+Collects every SQL string literal passed to .execute()/.executemany() in the
+given modules (default: app.py), runs EXPLAIN QUERY PLAN for each against an
+in-memory database built from migrations/schema.sql, and exits non-zero if
+any of them
+- scans a whole table or index instead of searching it, or
+- reads a user's entire completion history (an index search constrained
+  only by user_id), which grows without bound for long-time users.
+
+A query that is meant to do this can be exempted with a
+"# plan-check: allow" comment on the line before the execute() call.
+
+Usage: python scripts/check_query_plans.py [-v] [files...]
+"""
+import argparse
+import ast
+import os
+import sqlite3
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = os.path.join(ROOT, 'migrations', 'schema.sql')
+DEFAULT_FILES = [os.path.join(ROOT, 'app.py')]
+ALLOW_MARKER = 'plan-check: allow'
+# tables whose per-user row count grows with history; a lookup on these
+# must be bounded by more than user_id
+HISTORY_TABLES = ('completions',)
+
+
+def collect_queries(path):
+    """[(lineno, sql)] for string-literal SQL passed to execute/executemany."""
+    with open(path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    lines = source.splitlines()
+    tree = ast.parse(source, filename=path)
+    out = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or not node.args:
+            continue
+        func = node.func
+        if not isinstance(func, ast.Attribute) or func.attr not in ('execute', 'executemany'):
+            continue
+        arg = node.args[0]
+        if not (isinstance(arg, ast.Constant) and isinstance(arg.value, str)):
+            continue
+        if node.lineno >= 2 and ALLOW_MARKER in lines[node.lineno - 2]:
+            continue
+        out.append((node.lineno, arg.value))
+    return sorted(out)
+
+
+def plan_problems(db, sql):
+    """Plan lines that are full scans (empty list means the query is fine)."""
+    if sql.lstrip().upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA')):
+        return []
+    params = [None] * sql.count('?')
+    rows = db.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    bad = []
+    for r in rows:
+        detail = r[-1]
+        if detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW'):
+            bad.append(detail)
+        elif detail.startswith('SEARCH ') and detail.split()[1] in HISTORY_TABLES and detail.endswith('(user_id=?)'):
+            bad.append(detail + '  [whole user history]')
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('files', nargs='*', default=DEFAULT_FILES)
+    ap.add_argument('-v', '--verbose', action='store_true', help='print every plan')
+    args = ap.parse_args()
+
+    db = sqlite3.connect(':memory:')
+    with open(SCHEMA, 'r', encoding='utf-8') as f:
+        db.executescript(f.read())
+
+    failures = 0
+    for path in args.files:
+        for lineno, sql in collect_queries(path):
+            where = f"{os.path.relpath(path, ROOT)}:{lineno}"
+            try:
+                bad = plan_problems(db, sql)
+            except sqlite3.Error as e:
+                print(f"ERROR {where}: {e}")
+                failures += 1
+                continue
+            if bad:
+                failures += 1
+                print(f"SCAN  {where}: {' '.join(sql.split())}")
+                for detail in bad:
+                    print(f"      -> {detail}")
+            elif args.verbose:
+                print(f"ok    {where}: {' '.join(sql.split())}")
+    if failures:
+        print(f"{failures} queries degrade to full scans.")
+        return 1
+    print("All queries use indexed lookups.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
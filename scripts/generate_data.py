@@ -0,0 +1,120 @@
+# scripts/generate_data.py
+"""
+Synthetic data generator for benchmarks and load tests.
+
+Creates a new database (schema from migrations/schema.sql) and fills users,
+habits, habit_snapshots (every habit in every month), completions ending
+yesterday, and the completion rollups. Each habit gets its own completion
+rate, weekends are skipped more often, and a done day makes the next one a
+little more likely, so streak and consistency features are not uniform
+noise. Output is reproducible for a given --seed.
+
+All users share the password "password".
+
+Usage:
+  python scripts/generate_data.py --db /tmp/load.db --users 10000 --years 2 --habits 20
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import generate_password_hash
+
+import database
+import rollups
+
+
+def habit_days(rng, dates, weekend):
+    """Dates (strings) on which one synthetic habit was done."""
+    rate = rng.uniform(0.2, 0.9)
+    done = []
+    prev = False
+    for d, is_weekend in zip(dates, weekend):
+        p = rate * (0.6 if is_weekend else 1.0)
+        if prev:
+            p = min(1.0, p + 0.15)
+        prev = rng.random() < p
+        if prev:
+            done.append(d)
+    return done
+
+
+def generate(con, users, days, habits, seed=0, progress=True):
+    rng = random.Random(seed)
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    weekend = [(start + timedelta(days=i)).weekday() >= 5 for i in range(days)]
+    months = sorted({d[:7] for d in dates})
+    created = start.isoformat()
+    pw = generate_password_hash('password')  # hashing is slow; one hash for everyone
+    first_uid = (con.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0) + 1
+    completions = 0
+    t = time.perf_counter()
+    for uid in range(first_uid, first_uid + users):
+        con.execute('INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)',
+                    (uid, f'user{uid}@example.com', pw, created))
+        rows = []
+        for k in range(habits):
+            name = f'habit {k + 1}'
+            hid = con.execute('INSERT INTO habits (user_id, name, created_at) VALUES (?, ?, ?)', (uid, name, created)).lastrowid
+            con.executemany('INSERT INTO habit_snapshots (user_id, habit_id, name_at_that_time, month) VALUES (?, ?, ?, ?)',
+                            [(uid, hid, name, m) for m in months])
+            rows.extend((uid, hid, d) for d in habit_days(rng, dates, weekend))
+        con.executemany('INSERT INTO completions (user_id, habit_id, date) VALUES (?, ?, ?)', rows)
+        rollups.apply_completion_deltas(con, uid, [(hid, d, 1) for _, hid, d in rows])
+        completions += len(rows)
+        if uid % 100 == 0:
+            con.commit()
+            if progress:
+                n = uid - first_uid + 1
+                print(f"{n}/{users} users, {completions} completions ({n / (time.perf_counter() - t):.0f} users/s)", flush=True)
+    con.commit()
+    return completions
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Populate a new database with synthetic users.')
+    ap.add_argument('--db', required=True, help='database file to create')
+    ap.add_argument('--users', type=int, default=1000)
+    ap.add_argument('--years', type=float, default=1.0, help='history length ending yesterday')
+    ap.add_argument('--habits', type=int, default=10, help='habits per user')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--force', action='store_true', help='overwrite an existing file')
+    ap.add_argument('--quiet', action='store_true')
+    args = ap.parse_args()
+
+    path = os.path.abspath(args.db)
+    if path == os.path.join(ROOT, database.DB_PATH):
+        ap.error('refusing to write into the app database')
+    if os.path.exists(path):
+        if not args.force:
+            ap.error(f'{args.db} exists (use --force to overwrite)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    os.chdir(ROOT)  # schema path is relative to the repo root
+    con = database.connect(path)
+    # bulk load: durability does not matter for a throwaway database
+    con.execute('PRAGMA synchronous = OFF')
+    database.migrate(con)
+    started = time.perf_counter()
+    n = generate(con, args.users, int(args.years * 365), args.habits, args.seed, progress=not args.quiet)
+    con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    con.execute('ANALYZE')
+    con.close()
+    size = os.path.getsize(path) / 1024 / 1024
+    print(f"Wrote {args.users} users, {n} completions to {args.db} "
+          f"({size:.1f} MB) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
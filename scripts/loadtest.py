@@ -0,0 +1,226 @@
+# scripts/loadtest.py
+"""
+Local load test against the real Flask routes.
+
+Drives app.py through the Flask test client (no network), with a
+configurable mix of toggle / month / stats / predict / notifications
+requests from random users of a database made by generate_data.py.
+Reports p50/p95/p99 latency per route, throughput and the database size,
+and writes everything as JSON so runs can be compared between versions.
+Toggles write to the database, so regenerate it for strictly comparable runs.
+
+Usage:
+  python scripts/generate_data.py --db /tmp/load.db --users 1000 --years 2 --habits 20
+  python scripts/loadtest.py --db /tmp/load.db --requests 5000 --threads 4 --out before.json
+  python scripts/loadtest.py --db /tmp/load.db --requests 5000 --threads 4 --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MIX = 'toggle=30,month=25,stats=20,predict=15,notifications=10'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"unknown routes in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _recent_month(rng):
+    d = date.today().replace(day=1) - timedelta(days=rng.randint(0, 2) * 28)
+    return d.year, d.month
+
+
+def req_toggle(client, rng, uid, habits):
+    d = (date.today() - timedelta(days=rng.randint(0, 29))).isoformat()
+    return client.post('/api/completions/toggle', json={'habit_id': rng.choice(habits), 'date': d})
+
+
+def req_month(client, rng, uid, habits):
+    y, m = _recent_month(rng)
+    return client.get(f'/api/month/{y}/{m}/bundle')
+
+
+def req_stats(client, rng, uid, habits):
+    y, m = _recent_month(rng)
+    return client.get(f'/api/stats/{y}/{m}')
+
+
+def req_predict(client, rng, uid, habits):
+    return client.get('/api/predict/nextday')
+
+
+def req_notifications(client, rng, uid, habits):
+    return client.get('/api/notifications')
+
+
+ROUTES = {
+    'toggle': req_toggle,
+    'month': req_month,
+    'stats': req_stats,
+    'predict': req_predict,
+    'notifications': req_notifications,
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def db_size_mb(path):
+    return sum(os.path.getsize(path + s) for s in ('', '-wal', '-shm') if os.path.exists(path + s)) / 1024 / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(app, user_habits, mix, total, threads, seed):
+    """Returns ({route: [latency ms]}, errors, elapsed seconds)."""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    users = list(user_habits)
+    latencies = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    lock = threading.Lock()
+    per_thread = [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        client = app.test_client()
+        for _ in range(per_thread[i]):
+            uid = rng.choice(users)
+            name = rng.choices(names, weights)[0]
+            with client.session_transaction() as s:
+                s['user_id'] = uid
+            t = time.perf_counter()
+            resp = ROUTES[name](client, rng, uid, user_habits[uid])
+            ms = (time.perf_counter() - t) * 1000
+            with lock:
+                latencies[name].append(ms)
+                if resp.status_code >= 400:
+                    errors[name] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, elapsed):
+    routes = {}
+    for name, values in latencies.items():
+        values = sorted(values)
+        routes[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'p50_ms': percentile(values, 0.50),
+            'p95_ms': percentile(values, 0.95),
+            'p99_ms': percentile(values, 0.99),
+            'max_ms': values[-1] if values else 0.0,
+        }
+    count = sum(len(v) for v in latencies.values())
+    return {'requests': count, 'elapsed_s': elapsed, 'throughput_rps': count / elapsed if elapsed else 0.0,
+            'routes': routes}
+
+
+def print_report(result, baseline=None):
+    print(f"{result['summary']['requests']} requests in {result['summary']['elapsed_s']:.1f}s "
+          f"({result['summary']['throughput_rps']:.0f} req/s), DB {result['db_size_mb']:.1f} MB")
+    print(f"{'route':<14}{'count':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}" + ('   p95 vs baseline' if baseline else ''))
+    for name, r in result['summary']['routes'].items():
+        line = f"{name:<14}{r['count']:>7}{r['errors']:>5}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+        old = baseline['summary']['routes'].get(name) if baseline else None
+        if old and old['p95_ms']:
+            line += f"   {(r['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Load test the Flask routes against a generated database.')
+    ap.add_argument('--db', required=True, help='database made by scripts/generate_data.py')
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--threads', type=int, default=1)
+    ap.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default: {DEFAULT_MIX})')
+    ap.add_argument('--users', type=int, default=None, help='only use the first N users (hot set)')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--retrain', action='store_true', help='let toggles trigger background retraining')
+    ap.add_argument('--out', help='write the JSON result here')
+    ap.add_argument('--compare', help='JSON result of an earlier run to compare p95 against')
+    args = ap.parse_args()
+
+    path = os.path.abspath(args.db)
+    if not os.path.exists(path):
+        ap.error(f'{args.db} does not exist (create it with scripts/generate_data.py)')
+    mix = parse_mix(args.mix)
+    if not args.retrain:
+        os.environ['HABIT_RETRAIN_THRESHOLD'] = str(10 ** 9)
+
+    os.chdir(ROOT)  # schema path is relative to the repo root
+    import database
+    database.DB_PATH = path
+    from ai_engine import ml_model
+    # keep models of the test users out of the repo's models/
+    ml_model.MODEL_DIR = tempfile.mkdtemp(prefix='loadtest-models-')
+    from app import app
+
+    with database.get_pool().connection() as con:
+        sql = 'SELECT user_id, id FROM habits ORDER BY user_id, id'
+        user_habits = {}
+        for uid, hid in con.execute(sql):
+            user_habits.setdefault(uid, []).append(hid)
+    if args.users:
+        user_habits = dict(list(user_habits.items())[:args.users])
+    if not user_habits:
+        ap.error('database has no users with habits')
+
+    latencies, errors, elapsed = run(app, user_habits, mix, args.requests, args.threads, args.seed)
+    shutil.rmtree(ml_model.MODEL_DIR, ignore_errors=True)
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'params': {'db': args.db, 'requests': args.requests, 'threads': args.threads, 'mix': mix,
+                   'users': len(user_habits), 'seed': args.seed, 'retrain': args.retrain},
+        'db_size_mb': db_size_mb(path),
+        'summary': summarize(latencies, errors, elapsed),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 1 if any(errors.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
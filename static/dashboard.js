@@ -9,6 +9,9 @@
   const calendarEl = document.getElementById("calendar");
   const habitListEl = document.getElementById("habitList");
   const notificationsEl = document.getElementById("notifications");
+  const unreadCountEl = document.getElementById("unreadCount");
+  const markAllReadBtn = document.getElementById("markAllRead");
+  const moreNotificationsBtn = document.getElementById("moreNotifications");
   const insightsEl = document.getElementById("insights");
   const predictionsEl = document.getElementById("predictions");
 
@@ -67,7 +70,8 @@
       year: "numeric",
     });
 
-    const res = await fetch(`/api/month/${y}/${m}`);
+    // habits, completions, stats, notifications and predictions in one request
+    const res = await fetch(`/api/month/${y}/${m}/bundle`);
     if (res.status === 401) {
       window.location = "/login";
       return;
@@ -77,10 +81,10 @@
 
     renderHabits(data.habits);
     renderCalendar(data.habits, data.completions, y, m);
-
-    await fetchStats(y, m);
-    await loadNotifications();
-    await loadPredictions();
+    renderCharts(data.stats);
+    renderInsights(data.stats);
+    renderNotifications(data.notifications);
+    renderPredictions(data.predictions);
   }
 
   // --------------------------
@@ -227,14 +231,6 @@
   // --------------------------
   // STATS + CHARTS
   // --------------------------
-  async function fetchStats(y, m) {
-    const res = await fetch(`/api/stats/${y}/${m}`);
-    const data = await res.json();
-
-    renderCharts(data);
-    renderInsights(data);
-  }
-
   function renderCharts(d) {
     const habitLabels = d.habits.map((h) => h.name);
     const habitCounts = d.habit_counts.map((h) => h.count);
@@ -310,19 +306,49 @@
   // --------------------------
   // NOTIFICATIONS
   // --------------------------
+  // cursor for the next (older) page; null when everything is shown
+  let notificationsCursor = null;
+  const NOTIFICATIONS_PAGE = 20;
+
   async function loadNotifications() {
-    const res = await fetch("/api/notifications");
-    const data = await res.json();
+    const res = await fetch(`/api/notifications?limit=${NOTIFICATIONS_PAGE}`);
+    renderNotifications(await res.json());
+  }
 
-    notificationsEl.innerHTML = "";
+  async function loadMoreNotifications() {
+    if (notificationsCursor === null) return;
+    const res = await fetch(`/api/notifications?before=${notificationsCursor}&limit=${NOTIFICATIONS_PAGE}`);
+    renderNotifications(await res.json(), true);
+  }
 
-    if (!data.length) {
+  async function markRead(body) {
+    const res = await fetch("/api/notifications/read", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(body),
+    });
+    return res.json();
+  }
+
+  function renderUnread(unread) {
+    unreadCountEl.textContent = unread ? `(${unread})` : "";
+    markAllReadBtn.classList.toggle("hidden", !unread);
+  }
+
+  // page: {items, next_before, unread}; append adds an older page below
+  function renderNotifications(page, append = false) {
+    if (!append) notificationsEl.innerHTML = "";
+    notificationsCursor = page.next_before;
+    moreNotificationsBtn.classList.toggle("hidden", notificationsCursor === null);
+    renderUnread(page.unread);
+
+    if (!append && !page.items.length) {
       notificationsEl.innerHTML =
         '<div class="text-sm text-gray-500">No notifications</div>';
       return;
     }
 
-    data.forEach((n) => {
+    page.items.forEach((n) => {
       const li = document.createElement("li");
       li.className =
         "bg-[#FBFBFD] p-2 rounded flex justify-between items-start";
@@ -343,28 +369,30 @@
         </div>
       `;
 
+      const btn = li.querySelector(".mark-read");
+      if (btn) {
+        btn.addEventListener("click", async () => {
+          const data = await markRead({ ids: [n.id] });
+          btn.outerHTML = '<span class="text-xs text-green-600">Read</span>';
+          renderUnread(data.unread);
+        });
+      }
+
       notificationsEl.appendChild(li);
     });
-
-    document
-      .querySelectorAll(".mark-read")
-      .forEach((b) =>
-        b.addEventListener("click", async (e) => {
-          await fetch(`/api/notifications/${e.target.dataset.id}/read`, {
-            method: "POST",
-          });
-          await loadNotifications();
-        })
-      );
   }
 
+  markAllReadBtn.addEventListener("click", async () => {
+    await markRead({ all: true });
+    await loadNotifications();
+  });
+
+  moreNotificationsBtn.addEventListener("click", loadMoreNotifications);
+
   // --------------------------
   // ML PREDICTIONS
   // --------------------------
-  async function loadPredictions() {
-    const res = await fetch("/api/predict/nextday");
-    const data = await res.json();
-
+  function renderPredictions(data) {
     predictionsEl.innerHTML = "";
 
     if (!data.length) {